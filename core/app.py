@@ -1,16 +1,24 @@
+import atexit
 import os
+import queue
+import random
+import time
 import traceback
 import warnings
+from collections import deque
 from datetime import datetime
-from threading import Thread
+from threading import Event, Thread
 
-from flask import request, redirect, url_for, render_template, Flask
+from flask import request, redirect, url_for, render_template, jsonify, Flask
 from waitress import serve
 
+import async_collector
 import collector
+import models
 import scheduler
-from models import parse_data, save_data, newest_data_file
-from web_packer import dashboard_glance_data_packer, dashboard_glance_data_list_packer
+from models import compact_data, data_writer, data_log_name, data_folder_path, list_data_file_name, \
+    newest_data_file, traffic_data_cache, use_sqlite_store
+from web_packer import dashboard_glance_data_packer, dashboard_glance_data_list_packer, dashboard_glance_cache
 
 os.chdir(os.path.dirname(__file__))
 
@@ -18,18 +26,53 @@ collector.print_out_response_headers = False
 collector.print_out_response_body = False
 
 env_port = os.environ.get("TRAFFIC_TRACKER_PORT", 8080)
-env_sche_interval = os.environ.get("TRAFFIC_TRACKER_SCHE_INTERVAL", 0.1)
+env_sche_interval = float(os.environ.get("TRAFFIC_TRACKER_SCHE_INTERVAL", 60))  # longest sleep of the scheduler
+env_sche_workers = int(os.environ.get("TRAFFIC_TRACKER_SCHE_WORKERS", 8))  # groups collected at the same time
+env_sche_job_timeout = float(os.environ.get("TRAFFIC_TRACKER_SCHE_JOB_TIMEOUT", 300))  # seconds before reported
+env_sche_state_path = os.environ.get("TRAFFIC_TRACKER_SCHE_STATE", os.path.abspath("scheduler_state.json"))
+env_config_poll = float(os.environ.get("TRAFFIC_TRACKER_CONFIG_POLL", 10))  # seconds between checks of the config
+
+# "requests" for the blocking collector, "asyncio" for the collector engine on one event loop
+collector_engine = async_collector if collector.default_settings.get('collector-engine') == 'asyncio' else collector
+
+data_writer.configure(collector.default_settings.get('data-flush-seconds', 2),
+                      collector.default_settings.get('data-durability', 'none'))
+if collector.default_settings.get('data-backend') == 'sqlite':
+    use_sqlite_store(collector.default_settings.get('sqlite-path'))
 
 app = Flask(__name__)
+job_registry = scheduler.JobRegistry()
+collector_scheduler: (scheduler.Scheduler, None) = None  # started under __main__
+loaded_config_version = None
 
 
 class Log:
-    def __init__(self, path, encoding="utf-8", auto_save=True, print_out=True):
+    """
+    the messages are handed to a background writer thread, which appends them to the file in one batch
+    at most every flush_interval_seconds, so a caller never waits for the disk.
+    Only the latest ring_size messages are kept in log_queue, and at most max_pending are waiting to be written,
+    the messages beyond are dropped and counted.
+    The file is moved to path.<date> when the date changes or it grows over max_bytes, keeping backup_count of them.
+    """
+
+    def __init__(self, path, encoding="utf-8", auto_save=True, print_out=True, ring_size=1000,
+                 flush_interval_seconds=1, max_pending=10000, max_bytes=10 * 1024 * 1024, backup_count=7):
         self.path = path
         self.encoding = encoding
         self.auto_save = auto_save
         self.print_out = print_out
-        self.log_queue = list()
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.log_queue = deque(maxlen=ring_size)
+        self.dropped = 0
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._closed = Event()
+        self._date = datetime.fromtimestamp(os.path.getmtime(path)).date() if os.path.exists(path) else None
+        self._writer = Thread(target=self._write_loop, name="log-writer", daemon=True)
+        if self.auto_save:
+            self._writer.start()
+            atexit.register(self.close)
 
     @staticmethod
     def message_process(message) -> str:
@@ -42,29 +85,92 @@ class Log:
             message = str(message)
         self.log_queue.append(message)
         if self.auto_save:
-            self.save()
+            try:
+                self._pending.put_nowait(message)
+            except queue.Full:
+                self.dropped += 1
         if self.print_out:
             print(message)
 
-    def save(self):
+    def _take_pending(self) -> list[str]:
+        messages = []
+        while True:
+            try:
+                messages.append(self._pending.get_nowait())
+            except queue.Empty:
+                return messages
+
+    def _write_loop(self):
+        while not self._closed.is_set():
+            try:
+                messages = [self._pending.get(timeout=self.flush_interval_seconds)]
+            except queue.Empty:
+                continue
+            self.save(messages + self._take_pending())
+            self._closed.wait(self.flush_interval_seconds)
+        self.save(self._take_pending())
+
+    def save(self, messages: list[str] = None):
+        """append the messages, the pending ones if None, to the file, rotating it first if it is due"""
+        if messages is None:
+            messages = self._take_pending()
+        if not messages:
+            return
         try:
-            with open(self.path, "a" if os.path.exists("log.txt") else "w", encoding=self.encoding) as f:
-                f.write("\n".join(self.log_queue) + "\n")
+            self.rotate()
+            with open(self.path, "a", encoding=self.encoding) as f:
+                f.write("\n".join(messages) + "\n")
         except Exception as e:
             warnings.warn(RuntimeWarning(e))
 
+    def rotate(self):
+        today = datetime.now().date()
+        if self._date is None:
+            self._date = today
+        if not os.path.exists(self.path) or (self._date == today and os.path.getsize(self.path) < self.max_bytes):
+            self._date = today
+            return
+        rotated_path = f"{self.path}.{self._date.strftime('%Y-%m-%d')}"
+        index = 1
+        while os.path.exists(rotated_path):
+            rotated_path = f"{self.path}.{self._date.strftime('%Y-%m-%d')}.{index}"
+            index += 1
+        os.replace(self.path, rotated_path)
+        self._date = today
+        directory, name = os.path.split(self.path)
+        backups = sorted((entry for entry in os.scandir(directory) if entry.name.startswith(name + ".")),
+                         key=lambda entry: entry.stat().st_mtime)
+        for entry in backups[:max(len(backups) - self.backup_count, 0)]:
+            os.remove(entry.path)
+
+    def close(self):
+        """write the pending messages and stop the writer"""
+        self._closed.set()
+        if self._writer.is_alive():
+            self._writer.join()
+
     def __call__(self, *args, **kwargs):
         self.append(*args, **kwargs)
 
 
 def collect_group(group_name, date: (str, datetime) = None, repeat=3):
+    """
+    collect the group and save its data point, trying up to repeat times with a backoff.
+    The asyncio engine retries the group with its own backoff, so it is tried only once here
+    """
     try:
         if isinstance(date, datetime):
             date = date.strftime("%Y-%m-%d %H:%M:%S")
-        for _ in range(repeat):
+        if collector_engine is async_collector:
+            repeat = 1
+        for attempt in range(repeat):
+            if attempt:
+                # exponential backoff with jitter, so retries do not hit the failing urls back to back
+                backoff_seconds = collector.default_settings.get('retry-backoff-seconds', 5)
+                time.sleep(backoff_seconds * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
             try:
                 log(f"Collecting {group_name}")
-                new_data = collector.collect_group(group_name)
+                new_data = collector_engine.collect_group(group_name)
                 if new_data:
                     log(f"Collected {group_name}")
                     if date:
@@ -83,30 +189,74 @@ def collect_group(group_name, date: (str, datetime) = None, repeat=3):
         return {}
 
 
-def save_new_traffic(group_name, data, repeat=3):
-    if data:
-        for _ in range(repeat):
+def compact_closed_data(group_name, current_file_name):
+    """fold the logs of the closed months of the group back into their data files"""
+    for file_name in list_data_file_name():
+        if file_name != current_file_name and file_name.rsplit('.', 2)[0] == group_name:
             try:
-                history_data = parse_data(f"{group_name}.{datetime.now().strftime('%Y%m')}.json")
-                history_data.append(data)
-                save_data(f"{group_name}.{datetime.now().strftime('%Y%m')}.json", history_data)
-                break
+                if compact_data(file_name):
+                    log(f"compacted {file_name}")
             except Exception as e:
                 log(e)
-        else:
+
+
+def save_new_traffic(group_name, data):
+    """hand the data point to data_writer, which writes it within the flush window and logs a failed write"""
+    if data:
+        file_name = f"{group_name}.{datetime.now().strftime('%Y%m')}.json"
+        # the store keeps no logs to compact
+        if models.data_store is None and not os.path.exists(os.path.join(data_folder_path, data_log_name(file_name))):
+            compact_closed_data(group_name, file_name)
+        try:
+            data_writer.append(file_name, data)
+        except Exception as e:
+            log(e)
             log(f"failed to save {group_name}")
             return
-        log(f"saved {group_name}")
+        dashboard_glance_cache.invalidate(file_name)
+        log(f"saved {group_name}" if data_writer.flush_seconds <= 0 else f"queued {group_name} for saving")
     else:
         log(f"failed to collect_all {group_name}")
 
 
-def sche_collector(repeat=3):
-    """Making the schedule for collecting"""
-    for group in collector.get_groups():
-        scheduler.schedule(group.get('collect-every-minutes'),
-                           start_on_full_hour=group.get('collect-on-full-hour')
-                           )(lambda: collect_group(group.get('name'), date=datetime.now(), repeat=repeat))
+def group_job_spec(group: dict) -> dict:
+    """the arguments of scheduler.make_jobs for collecting the group"""
+    return dict(interval_minutes=group.get('collect-every-minutes'),
+                start_on_full_hour=bool(group.get('collect-on-full-hour')),
+                spread_seconds=collector.default_settings.get('collect-spread-seconds', 0),
+                jitter_seconds=collector.default_settings.get('collect-jitter-seconds', 0))
+
+
+def sche_collector(repeat=3) -> dict[str, list[str]]:
+    """Making the schedule for collecting, or reconciling it with the groups in the vault if already made"""
+    return job_registry.reconcile(
+        {group.get('name'): group_job_spec(group) for group in collector.get_groups()},
+        lambda name: lambda: collect_group(name, date=datetime.now(), repeat=repeat))
+
+
+def config_version() -> tuple:
+    return tuple(os.stat(path).st_mtime_ns if os.path.exists(path) else None
+                 for path in (collector.vault_path, collector.default_settings_path))
+
+
+def watch_config(repeat=3):
+    """reload the settings and the vault once their files changed and reconcile the collecting jobs with them"""
+    global loaded_config_version
+    version = config_version()
+    if version == loaded_config_version:
+        return
+    try:
+        collector.reload_settings()
+        async_collector.reload_settings()
+        data_writer.configure(collector.default_settings.get('data-flush-seconds', 2),
+                              collector.default_settings.get('data-durability', 'none'))
+    except Exception:
+        # most likely a file in the middle of being written, tried again on the next poll
+        log(traceback.format_exc())
+        return
+    loaded_config_version = version
+    changes = sche_collector(repeat)
+    log(f"config reloaded, jobs {changes}")
 
 
 def app_serve(host='0.0.0.0', port=8080, **kwargs):
@@ -128,6 +278,37 @@ def get_data_list():
     return dashboard_glance_data_list_packer()
 
 
+@app.route('/get_cache_info')
+def get_cache_info():
+    return jsonify(traffic_data=traffic_data_cache.info(), dashboard_glance=dashboard_glance_cache.info())
+
+
+@app.route('/get_collector_info')
+def get_collector_info():
+    return jsonify(sessions=collector.session_pool.stats(), circuits=collector.get_circuit_states())
+
+
+@app.route('/get_events')
+def get_events():
+    """the latest collection events, filtered by the args group, since and until in ISO format and limit"""
+    since = request.args.get('since')
+    until = request.args.get('until')
+    limit = request.args.get('limit')
+    try:
+        events = collector.collection_events.query(group=request.args.get('group'),
+                                                   since=datetime.fromisoformat(since).timestamp() if since else None,
+                                                   until=datetime.fromisoformat(until).timestamp() if until else None,
+                                                   limit=int(limit) if limit else None)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(events=events)
+
+
+@app.route('/get_scheduler_info')
+def get_scheduler_info():
+    return jsonify(jobs=collector_scheduler.stats() if collector_scheduler is not None else {})
+
+
 @app.route('/')
 def index():
     return redirect(url_for('dashboard_glance_selected', _filename=newest_data_file()))
@@ -158,15 +339,20 @@ if __name__ == '__main__':
 
     log = Log(os.path.abspath("log.txt"), auto_save=True)
     log(f"log started, saving at {log.path}")
+    data_writer.on_error = log
 
     app_thread = Thread(target=app_serve, kwargs={'host': '0.0.0.0', 'port': env_port})
     app_thread.start()
     log(f"app started in thread {app_thread}, port {env_port}")
 
+    loaded_config_version = config_version()
     sche_collector()
     log(f"collector scheduled, {scheduler.get_jobs()}")
+    scheduler.default_queue.add(scheduler.Job(watch_config, env_config_poll, name="watch_config"))
 
-    collector_scheduler = scheduler.Scheduler(env_sche_interval)
+    collector_scheduler = scheduler.Scheduler(env_sche_interval, max_workers=env_sche_workers,
+                                              job_timeout_seconds=env_sche_job_timeout,
+                                              state_path=env_sche_state_path)
     log(f"collector_scheduler starting {collector_scheduler}")
     collector_scheduler.start()
 
@@ -0,0 +1,167 @@
+import asyncio
+import atexit
+import random
+import time
+from threading import Lock, Thread
+from urllib.parse import urlsplit
+
+import aiohttp
+import requests
+
+import collector
+
+
+class AsyncCollector:
+    """
+    Collector engine running all collections on one asyncio event loop in a background thread,
+    with the concurrency limited globally and per host, a timeout per request
+    and exponential backoff with jitter between rounds over the urls of a group.
+    collect_group and collect_all are synchronous wrappers returning the same data as collector.
+    """
+
+    def __init__(self, max_concurrency: int = 100, max_per_host: int = 8, timeout: float = 10,
+                 retries: int = 2, backoff_seconds: float = 1):
+        self.max_concurrency = max_concurrency
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self._loop: (asyncio.AbstractEventLoop, None) = None
+        self._session: (aiohttp.ClientSession, None) = None
+        self._lock = Lock()
+
+    def configure(self, max_concurrency: int, max_per_host: int, timeout: float, retries: int,
+                  backoff_seconds: float):
+        """
+        apply new limits, the session is created again on the next request if the limits changed.
+        The old session is closed once the requests in flight on it have timed out at the latest
+        """
+        changed = (max_concurrency, max_per_host, timeout) != (self.max_concurrency, self.max_per_host, self.timeout)
+        old_timeout = self.timeout
+        self.max_concurrency = max_concurrency
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        if changed and self._loop is not None:
+            self.run(self._retire_session(old_timeout))
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                Thread(target=self._loop.run_forever, name="async-collector", daemon=True).start()
+            return self._loop
+
+    def run(self, coroutine):
+        """run the coroutine on the event loop of the engine and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._get_loop()).result()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # only called on the event loop, so no lock is needed
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, limit_per_host=self.max_per_host)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def _retire_session(self, delay: float):
+        session, self._session = self._session, None
+        if session is not None:
+            self._loop.call_later(delay, lambda: asyncio.ensure_future(session.close()))
+
+    async def _close_session(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def fetch(self, url: str, read_body=False, save_headers=False, group: str = None) -> dict:
+        """
+        request the subscription url and return its traffic data, the body is only read if read_body.
+        The outcome is recorded in the circuit breaker and the collection events of collector.
+        """
+        proxy = collector.proxies.get(urlsplit(url).scheme) if isinstance(collector.proxies, dict) else None
+        start = time.monotonic()
+        status = 0
+        try:
+            async with self._get_session().get(url, headers=collector.headers, proxy=proxy) as response:
+                status = response.status
+                if response.status != 200:
+                    raise requests.exceptions.RequestException(f"Request failed with status code {response.status}")
+                body = await response.text() if read_body else None
+                traffic_data = collector.build_traffic_data(str(response.url), response.headers,
+                                                            save_headers=save_headers, body=body)
+        except Exception as e:
+            collector.circuit_breaker.record_failure(url)
+            collector.collection_events.record(group, urlsplit(url).netloc, time.monotonic() - start, status,
+                                               outcome="timeout" if isinstance(e, asyncio.TimeoutError) else "error")
+            raise
+        latency = time.monotonic() - start
+        collector.latency_tracker.record(url, latency)
+        collector.circuit_breaker.record_success(url)
+        collector.collection_events.record(group, urlsplit(url).netloc, latency, status,
+                                           len(body.encode()) if body is not None else 0)
+        return traffic_data
+
+    async def collect_group_data(self, group: dict) -> dict:
+        """
+        try the urls of the group in order, then again after a backoff, up to retries more rounds.
+        The urls open in the circuit breaker are skipped.
+        """
+        urls = [url['url'] for url in group.get('urls-with-token')]
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff_seconds * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+            for url in collector.allowed_urls(urls, group.get('name')):
+                try:
+                    return await self.fetch(url, read_body=bool(group.get('save-body')),
+                                            save_headers=bool(group.get('save-headers')), group=group.get('name'))
+                except Exception as e:
+                    print(f"{url}: {e!r}")
+        raise requests.exceptions.RequestException("All urls failed")
+
+    async def collect_groups_data(self, groups: list[dict]) -> list:
+        """collect the groups concurrently, a failed group gives its exception"""
+        return await asyncio.gather(*(self.collect_group_data(group) for group in groups), return_exceptions=True)
+
+    def collect_group(self, group_name) -> dict:
+        return self.run(self.collect_group_data(collector.get_group(group_name)))
+
+    def collect_all(self, progress_wrapper=lambda _obj: _obj) -> dict:
+        """collect all groups, raise if any group failed like collector.collect_all"""
+        groups = collector.get_groups()
+        results = self.run(self.collect_groups_data(groups))
+        groups_data = dict()
+        for group, result in progress_wrapper(list(zip(groups, results))):
+            if isinstance(result, BaseException):
+                raise result
+            groups_data[group.get('name')] = result
+        return groups_data
+
+    def close(self):
+        if self._loop is not None:
+            self.run(self._close_session())
+
+
+def reload_settings():
+    engine.configure(collector.default_settings.get('async-max-concurrency', 100),
+                     collector.default_settings.get('async-max-per-host', 8),
+                     collector.request_timeout,
+                     collector.default_settings.get('async-retries', 2),
+                     collector.default_settings.get('async-backoff-seconds', 1))
+
+
+engine = AsyncCollector(collector.default_settings.get('async-max-concurrency', 100),
+                        collector.default_settings.get('async-max-per-host', 8),
+                        collector.request_timeout,
+                        collector.default_settings.get('async-retries', 2),
+                        collector.default_settings.get('async-backoff-seconds', 1))
+atexit.register(engine.close)
+
+
+def collect_group(group_name) -> dict:
+    return engine.collect_group(group_name)
+
+
+def collect_all(progress_wrapper=lambda _obj: _obj) -> dict:
+    return engine.collect_all(progress_wrapper)
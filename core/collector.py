@@ -1,8 +1,18 @@
 import json
 import os.path
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from email.utils import parsedate_to_datetime
+from threading import Lock
+from typing import Callable
+from urllib.parse import urlsplit
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from events import EventRing
 
 os.chdir(os.path.dirname(__file__))
 
@@ -14,6 +24,17 @@ headers = default_settings['headers']
 
 print_out_response_headers = default_settings.get('print-out-response-headers', True)
 print_out_response_body = default_settings.get('print-out-response-body', True)
+request_timeout = default_settings.get('request-timeout', 10)  # seconds, for connecting and for reading
+collect_max_workers = default_settings.get('collect-max-workers', 32)
+session_pool_maxsize = default_settings.get('session-pool-maxsize', 10)  # connections kept per host
+session_keep_alive_seconds = default_settings.get('session-keep-alive-seconds', 600)  # idle time before dropping
+hedge_requests = default_settings.get('hedge-requests', False)  # default of the group option 'hedge-requests'
+hedge_delay_seconds = default_settings.get('hedge-delay-seconds', 2)  # before the latency history of an url is known
+hedge_quantile = default_settings.get('hedge-quantile', 0.9)
+event_ring_size = default_settings.get('event-ring-size', 4096)  # collection events kept for /get_events
+circuit_failure_threshold = default_settings.get('circuit-failure-threshold', 3)  # consecutive failures to open
+circuit_cooldown_seconds = default_settings.get('circuit-cooldown-seconds', 60)  # doubled on every reopening
+circuit_max_cooldown_seconds = default_settings.get('circuit-max-cooldown-seconds', 3600)
 
 vault_path = os.path.abspath(os.path.join("..", "config", "vault.json"))
 with open(vault_path, 'r') as f:
@@ -34,12 +55,321 @@ def reload_settings():
     print_out_response_headers = default_settings.get('print-out-response-headers', True)
     global print_out_response_body
     print_out_response_body = default_settings.get('print-out-response-body', True)
+    global request_timeout
+    request_timeout = default_settings.get('request-timeout', 10)
+    global collect_max_workers
+    collect_max_workers = default_settings.get('collect-max-workers', 32)
+    global session_pool_maxsize
+    session_pool_maxsize = default_settings.get('session-pool-maxsize', 10)
+    global session_keep_alive_seconds
+    session_keep_alive_seconds = default_settings.get('session-keep-alive-seconds', 600)
+    session_pool.configure(session_pool_maxsize, session_keep_alive_seconds)
+    global hedge_requests
+    hedge_requests = default_settings.get('hedge-requests', False)
+    global hedge_delay_seconds
+    hedge_delay_seconds = default_settings.get('hedge-delay-seconds', 2)
+    global hedge_quantile
+    hedge_quantile = default_settings.get('hedge-quantile', 0.9)
+    global circuit_failure_threshold
+    circuit_failure_threshold = default_settings.get('circuit-failure-threshold', 3)
+    global circuit_cooldown_seconds
+    circuit_cooldown_seconds = default_settings.get('circuit-cooldown-seconds', 60)
+    global circuit_max_cooldown_seconds
+    circuit_max_cooldown_seconds = default_settings.get('circuit-max-cooldown-seconds', 3600)
+    circuit_breaker.configure(circuit_failure_threshold, circuit_cooldown_seconds, circuit_max_cooldown_seconds)
 
     global vault
     with open(vault_path, 'r') as _f:
         vault = json.load(_f)
 
 
+class CountingAdapter(HTTPAdapter):
+    """an adapter calling on_connect whenever one of its connections opens a socket, reconnects in place included"""
+
+    def __init__(self, on_connect: Callable, **kwargs):
+        self.on_connect = on_connect
+        super().__init__(**kwargs)
+
+    def _count_connects(self, manager):
+        on_connect = self.on_connect
+        pool_classes = {}
+        for scheme, pool_class in manager.pool_classes_by_scheme.items():
+            class Connection(pool_class.ConnectionCls):
+                def connect(self):
+                    on_connect()
+                    return super().connect()
+
+            pool_classes[scheme] = type(pool_class.__name__, (pool_class,), {"ConnectionCls": Connection})
+        manager.pool_classes_by_scheme = pool_classes
+        return manager
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self._count_connects(self.poolmanager)
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        if proxy in self.proxy_manager:
+            return self.proxy_manager[proxy]
+        return self._count_connects(super().proxy_manager_for(proxy, **proxy_kwargs))
+
+
+class SessionPool:
+    """
+    requests.Session per host reused across collections, so the connections are kept alive between ticks.
+    A session idle for longer than keep_alive_seconds is closed and created again on the next request.
+    A streamed GET closed before its body is read drops its connection, so the header-only collections
+    only keep their connections alive with head-request, as a HEAD response has no body to skip.
+    """
+
+    def __init__(self, pool_maxsize: int = 10, keep_alive_seconds: float = 600):
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive_seconds = keep_alive_seconds
+        self._sessions: dict[str, tuple[requests.Session, float]] = {}  # host -> (session, last used)
+        self._stats: dict[str, dict[str, int]] = {}
+        self._lock = Lock()
+
+    def configure(self, pool_maxsize: int, keep_alive_seconds: float):
+        """apply new limits, the current sessions are recreated if the pool size changed"""
+        self.keep_alive_seconds = keep_alive_seconds
+        if pool_maxsize != self.pool_maxsize:
+            self.pool_maxsize = pool_maxsize
+            self.close()
+
+    def _new_session(self, host: str) -> requests.Session:
+        session = requests.Session()
+        adapter = CountingAdapter(lambda: self._count_connect(host), pool_connections=1, pool_maxsize=self.pool_maxsize)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def get(self, url: str) -> requests.Session:
+        host = urlsplit(url).netloc
+        now = time.monotonic()
+        with self._lock:
+            stats = self._stats.setdefault(host, {"requests": 0, "sessions": 0, "connections": 0})
+            session, last_used = self._sessions.get(host, (None, now))
+            if session is not None and now - last_used > self.keep_alive_seconds:
+                session.close()
+                session = None
+            if session is None:
+                session = self._new_session(host)
+                stats["sessions"] += 1
+            self._sessions[host] = (session, now)
+            stats["requests"] += 1
+        return session
+
+    def _count_connect(self, host: str):
+        with self._lock:
+            self._stats[host]["connections"] += 1
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """requests, sessions and sockets connected per host, the rest of the requests reused a connection"""
+        with self._lock:
+            return {host: {**stats, "reused": max(stats["requests"] - stats["connections"], 0)}
+                    for host, stats in self._stats.items()}
+
+    def close(self):
+        with self._lock:
+            for session, _ in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+session_pool = SessionPool(session_pool_maxsize, session_keep_alive_seconds)
+
+
+class LatencyTracker:
+    """latencies of the latest successful requests per url"""
+
+    def __init__(self, history_size: int = 50, min_samples: int = 5):
+        self.history_size = history_size
+        self.min_samples = min_samples
+        self._latencies: dict[str, deque[float]] = {}
+        self._lock = Lock()
+
+    def record(self, url: str, latency: float):
+        with self._lock:
+            self._latencies.setdefault(url, deque(maxlen=self.history_size)).append(latency)
+
+    def quantile(self, url: str, q: float) -> (float, None):
+        """the q quantile of the latency history of the url, None if there are too few samples"""
+        with self._lock:
+            latencies = sorted(self._latencies.get(url, ()))
+        if len(latencies) < self.min_samples:
+            return None
+        return latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+
+
+latency_tracker = LatencyTracker()
+
+
+class CircuitBreaker:
+    """
+    circuit breaker per url. An url is opened after failure_threshold consecutive failures and skipped
+    until its cooldown has passed, then it is half-open and lets a single trial request through:
+    a success closes it, a failure opens it again with the cooldown doubled up to max_cooldown_seconds.
+    The cooldowns are jittered so the urls opened together are not all retried at once.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold: int = 3, cooldown_seconds: float = 60, max_cooldown_seconds: float = 3600):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.max_cooldown_seconds = max_cooldown_seconds
+        self._circuits: dict[str, dict] = {}
+        self._lock = Lock()
+
+    def configure(self, failure_threshold: int, cooldown_seconds: float, max_cooldown_seconds: float):
+        with self._lock:
+            self.failure_threshold = failure_threshold
+            self.cooldown_seconds = cooldown_seconds
+            self.max_cooldown_seconds = max_cooldown_seconds
+
+    def _circuit(self, url: str) -> dict:
+        return self._circuits.setdefault(url, {"state": self.CLOSED, "failures": 0, "opened": 0,
+                                               "retry_at": 0.0, "trial": False})
+
+    def allow(self, url: str) -> bool:
+        """whether a request to the url may be made now, a half-open url allows one trial until it is recorded"""
+        with self._lock:
+            circuit = self._circuit(url)
+            if circuit["state"] == self.OPEN and time.monotonic() >= circuit["retry_at"]:
+                circuit["state"] = self.HALF_OPEN
+                circuit["trial"] = False
+            if circuit["state"] == self.HALF_OPEN:
+                if circuit["trial"]:
+                    return False
+                circuit["trial"] = True
+                return True
+            return circuit["state"] == self.CLOSED
+
+    def release(self, url: str):
+        """give back the trial of a half-open url whose request was never made"""
+        with self._lock:
+            self._circuit(url)["trial"] = False
+
+    def record_success(self, url: str):
+        with self._lock:
+            circuit = self._circuit(url)
+            circuit.update(state=self.CLOSED, failures=0, opened=0, retry_at=0.0, trial=False)
+
+    def record_failure(self, url: str):
+        with self._lock:
+            circuit = self._circuit(url)
+            circuit["failures"] += 1
+            circuit["trial"] = False
+            if circuit["state"] == self.HALF_OPEN or circuit["failures"] >= self.failure_threshold:
+                cooldown = min(self.cooldown_seconds * 2 ** circuit["opened"], self.max_cooldown_seconds)
+                circuit["state"] = self.OPEN
+                circuit["opened"] += 1
+                circuit["retry_at"] = time.monotonic() + cooldown * random.uniform(0.8, 1.2)
+
+    def state(self, url: str) -> dict:
+        """state, consecutive failures and seconds until the next trial of the url"""
+        with self._lock:
+            circuit = dict(self._circuit(url))
+        retry_in = max(circuit["retry_at"] - time.monotonic(), 0) if circuit["state"] == self.OPEN else 0
+        state = self.HALF_OPEN if circuit["state"] == self.OPEN and not retry_in else circuit["state"]
+        return {"state": state, "failures": circuit["failures"], "retry_in": round(retry_in, 3)}
+
+
+collection_events = EventRing(event_ring_size)
+circuit_breaker = CircuitBreaker(circuit_failure_threshold, circuit_cooldown_seconds, circuit_max_cooldown_seconds)
+hedge_executor = ThreadPoolExecutor(max_workers=collect_max_workers, thread_name_prefix="hedge")
+
+
+def timed_fetch(fetch: Callable[[str], requests.Response], url: str, group: str = None) -> requests.Response:
+    """
+    fetch the url, record its latency if it succeeded,
+    the outcome in the circuit breaker and an event of the group in collection_events
+    """
+    start = time.monotonic()
+    try:
+        response = fetch(url)
+    except Exception as e:
+        circuit_breaker.record_failure(url)
+        status = getattr(getattr(e, 'response', None), 'status_code', 0) or 0
+        outcome = "timeout" if isinstance(e, requests.exceptions.Timeout) else "error"
+        collection_events.record(group, urlsplit(url).netloc, time.monotonic() - start, status, outcome=outcome)
+        raise
+    latency = time.monotonic() - start
+    latency_tracker.record(url, latency)
+    circuit_breaker.record_success(url)
+    collection_events.record(group, urlsplit(url).netloc, latency, response.status_code,
+                             getattr(response.raw, 'tell', lambda: 0)())
+    return response
+
+
+def allowed_urls(urls: list[str], group: str = None):
+    """the urls not skipped by the circuit breaker, checked lazily right before each one is requested"""
+    for url in urls:
+        if circuit_breaker.allow(url):
+            yield url
+        else:
+            print(f"Skipped {urlsplit(url).netloc}: circuit open")
+            collection_events.record(group, urlsplit(url).netloc, outcome="skipped")
+
+
+def failover_request(urls: list[str], fetch: Callable[[str], requests.Response],
+                     group: str = None) -> requests.Response:
+    """try the urls one after another until one succeeds"""
+    for url in allowed_urls(urls, group):
+        try:
+            return timed_fetch(fetch, url, group)
+        except Exception as e:
+            print(e)
+    raise requests.exceptions.RequestException("All urls failed")
+
+
+def hedge_delay(url: str) -> float:
+    """how long to wait for the url before starting the next one, its latency quantile once known"""
+    delay = latency_tracker.quantile(url, hedge_quantile)
+    return hedge_delay_seconds if delay is None else delay
+
+
+def hedged_request(urls: list[str], fetch: Callable[[str], requests.Response],
+                   group: str = None) -> requests.Response:
+    """
+    start with the first url, start the next one in parallel whenever the latest one has not answered
+    within its hedge delay or has failed, the first successful response wins.
+    The losing requests are cancelled if not started yet, or closed when they finish.
+    """
+    pending = dict()
+    candidates = allowed_urls(urls, group)
+    next_url = next(candidates, None)
+    deadline = None
+    try:
+        while True:
+            if next_url is not None and (not pending or time.monotonic() >= deadline):
+                pending[hedge_executor.submit(timed_fetch, fetch, next_url, group)] = next_url
+                deadline = time.monotonic() + hedge_delay(next_url)
+                next_url = next(candidates, None)
+            if not pending:
+                raise requests.exceptions.RequestException("All urls failed")
+            done, _ = wait(pending, return_when=FIRST_COMPLETED,
+                           timeout=max(deadline - time.monotonic(), 0) if next_url is not None else None)
+            for future in done:
+                del pending[future]
+                if future.exception() is None:
+                    return future.result()
+                print(future.exception())
+    finally:
+        if next_url is not None:
+            circuit_breaker.release(next_url)
+        for future, url in pending.items():
+            if future.cancel():
+                circuit_breaker.release(url)
+            else:
+                future.add_done_callback(close_response)
+
+
+def close_response(future):
+    if future.exception() is None:
+        future.result().close()
+
+
 def get_vault_data() -> dict[str, list[dict]]:
     return vault
 
@@ -56,70 +386,110 @@ def get_group(group_name: str) -> dict:
     return [group for group in vault.get('groups') if group.get('name') == group_name][0]
 
 
-def collect_all(progress_wrapper=lambda _obj: _obj):
+def get_circuit_states() -> list[dict]:
+    """circuit breaker state of every url in the vault, named by group, url name and host to keep the tokens out"""
+    return [{"group": group.get('name'), "name": url.get('name'), "host": urlsplit(url['url']).hostname,
+             **circuit_breaker.state(url['url'])}
+            for group in get_groups() for url in group.get('urls-with-token')]
+
+
+def collect_all(progress_wrapper=lambda _obj: _obj, max_workers: int = None):
+    """collect all groups concurrently on a bounded thread pool, raise if any group failed"""
+    groups = vault.get('groups')
+    with ThreadPoolExecutor(max_workers=max_workers or collect_max_workers) as executor:
+        futures = [(group.get('name'), executor.submit(collect_group_data, group)) for group in groups]
+        for _ in progress_wrapper(as_completed([future for _, future in futures])):
+            pass
     groups_data = dict()
-    for group in progress_wrapper(vault.get('groups')):
-        save_headers = group.get('save-headers')
-        save_body = group.get('save-body')
-        for url in group.get('urls-with-token'):
-            try:
-                response = get_subscribe(url['url'])
-            except Exception as e:
-                print(e)
-            else:
-                break
-        else:
-            raise requests.exceptions.RequestException("All urls failed")
-        traffic_data = dict()
-        traffic_data['url'] = response.url
-        traffic_data['date'] = parsedate_to_datetime(response.headers.get('Date')).strftime("%Y-%m-%d %H:%M:%S")
-        subs_info = parse_subscription_userinfo(response.headers)
-        traffic_data.update(subs_info)
-        if save_headers:
-            traffic_data['headers'] = dict(response.headers)
-        if save_body:
-            traffic_data['body'] = response.text
-        # print(traffic_data)
-        groups_data[group.get('name')] = traffic_data
+    for group_name, future in futures:
+        groups_data[group_name] = future.result()
     return groups_data
 
 
 def collect_group(group_name):
-    for url in get_group(group_name)['urls-with-token']:
-        try:
-            response = get_subscribe(url['url'])
-        except Exception as e:
-            print(e)
-        else:
-            break
+    return collect_group_data(get_group(group_name))
+
+
+def collect_group_data(group: dict) -> dict:
+    save_headers = group.get('save-headers')
+    save_body = group.get('save-body')
+    urls = [url['url'] for url in group.get('urls-with-token')]
+    if save_body:
+        fetch = get_subscribe
+    else:
+        def fetch(_url):
+            return get_subscribe_headers(_url, use_head=group.get('head-request', False))
+    if group.get('hedge-requests', hedge_requests):
+        response = hedged_request(urls, fetch, group.get('name'))
     else:
-        raise requests.exceptions.RequestException("All urls failed")
+        response = failover_request(urls, fetch, group.get('name'))
+    return build_traffic_data(response.url, response.headers, save_headers=save_headers,
+                              body=response.text if save_body else None)
+
+
+def build_traffic_data(url: str, response_headers, save_headers=False, body: str = None) -> dict:
+    """the traffic data point of a subscription response"""
     traffic_data = dict()
-    traffic_data['url'] = response.url
-    traffic_data['date'] = parsedate_to_datetime(response.headers.get('Date')).strftime("%Y-%m-%d %H:%M:%S")
-    subs_info = parse_subscription_userinfo(response.headers)
+    traffic_data['url'] = url
+    traffic_data['date'] = parsedate_to_datetime(response_headers.get('Date')).strftime("%Y-%m-%d %H:%M:%S")
+    subs_info = parse_subscription_userinfo(response_headers)
     traffic_data.update(subs_info)
+    if save_headers:
+        traffic_data['headers'] = dict(response_headers)
+    if body is not None:
+        traffic_data['body'] = body
     return traffic_data
 
 
-def get_subscribe(url):
-    response = requests.get(url, headers=headers, proxies=proxies)
+def get_subscribe(url, timeout=None, read_body=True, method="GET"):
+    """
+    request the subscription, with read_body False the response is streamed
+    and closed as soon as the headers arrived, so the body is never downloaded
+    """
+    response = session_pool.get(url).request(method, url, headers=headers, proxies=proxies,
+                                             timeout=request_timeout if timeout is None else timeout,
+                                             stream=not read_body)
 
     # if request failed
     if response.status_code != 200:
-        raise requests.exceptions.RequestException(f"Request failed with status code {response.status_code}")
+        response.close()
+        raise requests.exceptions.RequestException(f"Request failed with status code {response.status_code}",
+                                                   response=response)
 
     if print_out_response_headers:
         print("Response Headers:")
         for key, value in response.headers.items():
             print(f"{key}: {value}")
-    if print_out_response_body:
+    if not read_body:
+        if method == "HEAD":
+            # marks the empty body as read, so closing gives the connection back to the pool instead of dropping it
+            _ = response.content
+        response.close()
+    elif print_out_response_body:
         print("\nResponse Body:")
         print(response.text)
 
     return response
 
 
+def get_subscribe_headers(url, timeout=None, use_head=False):
+    """
+    request only the headers of the subscription, by HEAD if use_head,
+    falling back to a GET without reading the body if the provider rejects HEAD (e.g. 405 or 501)
+    or leaves out Subscription-Userinfo for it, so only the outcome of the GET counts
+    """
+    if use_head:
+        try:
+            response = get_subscribe(url, timeout=timeout, read_body=False, method="HEAD")
+        except requests.exceptions.RequestException as e:
+            if e.response is None:
+                raise
+        else:
+            if response.headers.get("Subscription-Userinfo") is not None:
+                return response
+    return get_subscribe(url, timeout=timeout, read_body=False)
+
+
 def parse_subscription_userinfo(response_headers):
     userinfo_str: str = response_headers.get("Subscription-Userinfo")
     try:
@@ -0,0 +1,82 @@
+import json
+import mmap
+import os
+import struct
+from array import array
+
+column_file_extension = ".bin"
+magic = b"TTCOLS02"
+# magic, count, mtime_ns and size of the source file, size of the url table, rows added in front of the source points
+header = struct.Struct("<8sqqqqq")
+# the 64 bit type of every column in the order they are stored, the timestamps are float64 with nan for a missing one
+column_types = {"date_in_ts": 'd', "upload": 'q', "download": 'q', "total": 'q', "expire_in_ts": 'd',
+                "url_index": 'q'}
+
+
+def write_column_file(path: str, source_version: tuple[int, int], columns: dict[str, array], urls: list[str],
+                      added_rows: int = 0):
+    """
+    write the columns and the url table to a column file through a temporary file,
+    source_version is the (mtime_ns, size) of the file the columns were read from,
+    added_rows the number of rows in front that are not in it, like an original point
+    """
+    count = len(columns["date_in_ts"])
+    url_table = json.dumps(urls).encode()
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as file:
+        file.write(header.pack(magic, count, source_version[0], source_version[1], len(url_table), added_rows))
+        for name, typecode in column_types.items():
+            column = columns[name]
+            if getattr(column, 'typecode', None) != typecode:
+                column = array(typecode, column)
+            if len(column) != count:
+                raise ValueError(f"column {name} has {len(column)} values instead of {count}")
+            if column.itemsize != 8:
+                raise ValueError(f"column {name} is not 64 bits")
+            file.write(column.tobytes())
+        file.write(url_table)
+    os.replace(temp_path, path)
+
+
+class ColumnFile:
+    """
+    a column file opened with mmap, its columns are 64 bit memoryviews into the mapping without copying.
+    They are valid until close, which fails while views taken of them are alive,
+    so a reader keeping the columns keeps the file open instead and the mapping goes with the last reference.
+    The header keeps the version of the source file, see is_current
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        try:
+            file_magic, self.count, mtime_ns, size, url_table_size, self.added_rows = header.unpack_from(self._view)
+            if file_magic != magic:
+                raise ValueError(f"{path} is not a column file of this version")
+            self.source_version = (mtime_ns, size)
+            self.columns: dict[str, memoryview] = {}
+            offset = header.size
+            for name, typecode in column_types.items():
+                self.columns[name] = self._view[offset:offset + 8 * self.count].cast(typecode)
+                offset += 8 * self.count
+            self.urls: list[str] = json.loads(bytes(self._view[offset:offset + url_table_size]))
+        except Exception:
+            self.close()
+            raise
+
+    def is_current(self, source_version: tuple[int, int]) -> bool:
+        return tuple(source_version) == self.source_version
+
+    def close(self):
+        for column in getattr(self, 'columns', {}).values():
+            column.release()
+        self._view.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,80 @@
+import time
+from array import array
+from datetime import datetime
+from threading import Lock
+
+OUTCOMES = ("success", "error", "timeout", "skipped")
+
+
+class EventRing:
+    """
+    the latest capacity collection events in preallocated columns, a new event overwrites the oldest one,
+    so the memory stays the same however long the process runs.
+    The groups and hosts are stored as indices into a table of names, which only grows with the vault
+    """
+
+    def __init__(self, capacity: int = 4096):
+        self.capacity = capacity
+        self._time = array('d', [0.0]) * capacity
+        self._latency = array('d', [0.0]) * capacity
+        self._status = array('h', [0]) * capacity
+        self._bytes = array('q', [0]) * capacity
+        self._group = array('l', [0]) * capacity
+        self._host = array('l', [0]) * capacity
+        self._outcome = array('b', [0]) * capacity
+        self._names: list[str] = []
+        self._name_index: dict[str, int] = {}
+        self._next = 0
+        self._count = 0
+        self._lock = Lock()
+
+    def _intern(self, name: str) -> int:
+        index = self._name_index.get(name)
+        if index is None:
+            index = self._name_index[name] = len(self._names)
+            self._names.append(name)
+        return index
+
+    def record(self, group: str, host: str, latency: float = 0, status: int = 0, nbytes: int = 0,
+               outcome: str = "success"):
+        with self._lock:
+            i = self._next
+            self._time[i] = time.time()
+            self._latency[i] = latency
+            self._status[i] = status
+            self._bytes[i] = nbytes
+            self._group[i] = self._intern(group or "")
+            self._host[i] = self._intern(host or "")
+            self._outcome[i] = OUTCOMES.index(outcome)
+            self._next = (i + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+
+    def query(self, group: str = None, since: float = None, until: float = None, limit: int = None) -> list[dict]:
+        """the events of the group between the timestamps since and until, the latest limit of them, oldest first"""
+        with self._lock:
+            group_index = self._name_index.get(group) if group is not None else None
+            if group is not None and group_index is None:
+                return []
+            events = []
+            for n in range(self._count):
+                i = (self._next - 1 - n) % self.capacity
+                timestamp = self._time[i]
+                if since is not None and timestamp < since:
+                    break  # the events are in time order, so the older ones are out of range too
+                if (until is not None and timestamp > until) or \
+                        (group_index is not None and self._group[i] != group_index):
+                    continue
+                events.append({"time": datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S"),
+                               "group": self._names[self._group[i]],
+                               "host": self._names[self._host[i]],
+                               "latency": round(self._latency[i], 3),
+                               "status": self._status[i],
+                               "bytes": self._bytes[i],
+                               "outcome": OUTCOMES[self._outcome[i]]})
+                if limit is not None and len(events) >= limit:
+                    break
+        events.reverse()
+        return events
+
+    def __len__(self):
+        return self._count
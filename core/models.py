@@ -1,14 +1,25 @@
+import atexit
 import json
 import os
 import warnings
 from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left
 from collections import OrderedDict
+from collections.abc import Sequence
 from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Iterable
+from math import isnan, nan
+from threading import Event, Lock, RLock, Thread
+from typing import Callable, Iterable
+
+from column_file import ColumnFile, column_file_extension, write_column_file
 
 data_folder_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "data"))
+data_file_extension = ".json"
+data_log_extension = ".jsonl"  # append-only log, one data point per line
 allow_negative_traffic = False
+data_store = None  # an sqlite_store.SQLiteStore keeping the data instead of the data folder, see use_sqlite_store
 
 
 def parse_json(file_path: str):
@@ -24,12 +35,64 @@ def parse_json(file_path: str):
         return {}
 
 
-def save_json(file_path: str, data, indent=None):
+def parse_json_lines(file_path: str) -> list:
+    try:
+        return read_json_lines(file_path)[0]
+    except FileNotFoundError:
+        warnings.warn(f"file '{file_path}' not found, empty list instead.")
+        return []
+
+
+def read_json_lines(file_path: str, offset: int = 0) -> tuple[list, int]:
+    """
+    parse the complete lines of a JSON lines file from the byte offset,
+    return the parsed and the offset after the last complete line, a partially written line is left for later
+    """
+    with open(file_path, 'rb') as file:
+        file.seek(offset)
+        content = file.read()
+    end = content.rfind(b"\n") + 1
+    parsed = []
+    for line in content[:end].splitlines():
+        if not line.strip():
+            continue
+        try:
+            parsed.append(json.loads(line))
+        except json.JSONDecodeError as e:
+            warnings.warn(f"Error parsing JSON line in '{file_path}': {e}\nline skipped")
+    return parsed, offset + end
+
+
+def save_json(file_path: str, data, indent=None, durability: str = "none") -> bool:
+    """write a temporary file and rename it over the file, so a reader never sees a partial file"""
+    temp_path = file_path + ".tmp"
     try:
-        with open(file_path, 'w') as file:
+        with open(temp_path, 'w') as file:
             json.dump(data, file, default=handle_non_serializable, indent=indent)
+            sync_file(file, durability)
+        os.replace(temp_path, file_path)
+        sync_folder(os.path.dirname(file_path), durability)
     except Exception as e:
         warnings.warn(f"Error saving JSON file: {e}")
+        return False
+    return True
+
+
+def sync_file(file, durability: str):
+    """flush the open file to the disk, unless the durability is none"""
+    if durability != "none":
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def sync_folder(folder_path: str, durability: str):
+    """with the durability "fsync-dir", flush the entries of the folder, making a rename or a new file durable"""
+    if durability == "fsync-dir" and hasattr(os, 'O_DIRECTORY'):
+        fd = os.open(folder_path, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
 
 
 def handle_non_serializable(obj):
@@ -42,32 +105,323 @@ def handle_non_serializable(obj):
         return "__non_serializable__"
 
 
+def data_log_name(file_name: str) -> str:
+    """name of the append-only log next to a data file, `<group>.<YYYYMM>.jsonl`"""
+    return os.path.splitext(file_name)[0] + data_log_extension
+
+
+def data_file_name(file_name: str) -> str:
+    """name of the data file a data file or its log belongs to, `<group>.<YYYYMM>.json`"""
+    return os.path.splitext(file_name)[0] + data_file_extension
+
+
 def parse_data(file_name: str) -> list[dict[str, object]]:
+    """parse the data file together with the points appended to its log"""
+    return parse_data_with_log_offset(file_name)[0]
+
+
+def parse_data_with_log_offset(file_name: str) -> tuple[list[dict[str, object]], int]:
+    """parse_data, also return the byte offset in the log parsed up to"""
+    if data_store is not None:
+        return data_store.read(file_name), 0
     file_path = os.path.join(data_folder_path, file_name)
-    parsed = parse_json(file_path)
-    return parsed if len(parsed) else []
+    log_path = os.path.join(data_folder_path, data_log_name(file_name))
+    has_log = os.path.exists(log_path)
+    parsed = parse_json(file_path) if not has_log or os.path.exists(file_path) else []
+    parsed = list(parsed) if len(parsed) else []
+    log_offset = 0
+    if has_log:
+        try:
+            log_parsed, log_offset = read_json_lines(log_path)
+        except FileNotFoundError:  # compacted meanwhile
+            warnings.warn(f"file '{log_path}' not found, empty list instead.")
+        else:
+            parsed.extend(log_parsed)
+    return parsed, log_offset
+
+
+def parse_data_log_tail(file_name: str, offset: int) -> tuple[list[dict[str, object]], int]:
+    """parse the points appended to the log of the data file after the byte offset"""
+    if data_store is not None:
+        return [], offset
+    return read_json_lines(os.path.join(data_folder_path, data_log_name(file_name)), offset)
 
 
 def save_data(file_name: str, data: list[dict[str, object]]):
+    """save the whole data, the log is dropped since the data already contains its points"""
+    if data_store is not None:
+        data_store.write(file_name, data)
+        return
     file_path = os.path.join(data_folder_path, file_name)
-    save_json(file_path, data)
+    log_path = os.path.join(data_folder_path, data_log_name(file_name))
+    with data_writer.file_lock(file_name):
+        if save_json(file_path, data, durability=data_writer.durability) and os.path.exists(log_path):
+            os.remove(log_path)
+
+
+def append_data(file_name: str, data_point: dict[str, object]):
+    """append a single data point to the log of the data file without rewriting the file"""
+    append_data_lines(file_name, [json.dumps(data_point, default=handle_non_serializable) + "\n"])
+
+
+def append_data_lines(file_name: str, lines: list[str]):
+    """
+    append the serialized data points to the log of the data file in one write,
+    after a newline if the log ends with a partial line, so the points are not glued onto it
+    """
+    if data_store is not None:
+        data_store.append_lines(file_name, lines)
+        return
+    log_path = os.path.join(data_folder_path, data_log_name(file_name))
+    with data_writer.file_lock(file_name):
+        created = not os.path.exists(log_path)
+        with open(log_path, 'a+b') as file:
+            content = "".join(lines).encode()
+            if file.tell():
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b"\n":
+                    content = b"\n" + content
+            file.write(content)
+            sync_file(file, data_writer.durability)
+        if created:
+            sync_folder(data_folder_path, data_writer.durability)
+
+
+def compact_data(file_name: str) -> bool:
+    """fold the log of the data file back into the json file, return False if there is no log"""
+    file_path = os.path.join(data_folder_path, data_file_name(file_name))
+    log_path = os.path.join(data_folder_path, data_log_name(file_name))
+    data_writer.flush(file_name)
+    if data_store is not None:
+        return False
+    with data_writer.file_lock(file_name):
+        if not os.path.exists(log_path):
+            return False
+        data = parse_data(data_file_name(file_name))
+        if not save_json(file_path, data, durability=data_writer.durability):
+            return False
+        os.remove(log_path)
+        if is_closed_month(file_name):
+            try:
+                write_data_columns(file_name, data)
+            except Exception as e:
+                warnings.warn(f"Error writing the column file of '{file_name}': {e}")
+    return True
+
+
+class DataWriter:
+    """
+    coalesces the data points appended to the logs of the data files:
+    the points are queued per file and a background thread appends the points of every file in one write
+    per flush window of flush_seconds, the points are written right away if flush_seconds is 0.
+    Every write to a data file or its log holds the lock of the file, so writers never interleave.
+    durability is "none" to leave the writes to the os, "fsync" to sync every written file
+    or "fsync-dir" to also sync the data folder after a file was created or replaced.
+    The points of a failed write are queued again, up to the latest max_pending per file,
+    and the failure is reported to on_error, a warning by default.
+    """
+
+    def __init__(self, flush_seconds: float = 2, durability: str = "none", max_pending: int = 10000,
+                 on_error: Callable[[str], None] = None):
+        self.flush_seconds = flush_seconds
+        self.durability = durability
+        self.max_pending = max_pending
+        self.on_error = on_error
+        self._pending: dict[str, list[str]] = {}
+        self._file_locks: dict[str, RLock] = {}
+        self._lock = Lock()
+        self._flush_lock = Lock()  # keeps the order of the points when two flushes overlap
+        self._closed = Event()
+        self._thread: (Thread, None) = None
+
+    def configure(self, flush_seconds: float, durability: str):
+        if durability not in ("none", "fsync", "fsync-dir"):
+            warnings.warn(f"unknown durability '{durability}', 'none' instead", RuntimeWarning)
+            durability = "none"
+        self.flush_seconds = flush_seconds
+        self.durability = durability
+
+    def file_lock(self, file_name: str) -> RLock:
+        """the lock of the data file, shared with its log"""
+        with self._lock:
+            return self._file_locks.setdefault(data_file_name(file_name), RLock())
+
+    def append(self, file_name: str, data_point: dict[str, object]):
+        """queue the data point for the log of the data file, it is serialized right away"""
+        line = json.dumps(data_point, default=handle_non_serializable) + "\n"
+        if self.flush_seconds <= 0:
+            append_data_lines(file_name, [line])
+            return
+        with self._lock:
+            self._pending.setdefault(data_file_name(file_name), []).append(line)
+            if self._thread is None:
+                self._thread = Thread(target=self._flush_loop, name="data-writer", daemon=True)
+                self._thread.start()
+
+    def pending(self) -> dict[str, int]:
+        """the number of points queued per data file"""
+        with self._lock:
+            return {file_name: len(lines) for file_name, lines in self._pending.items()}
+
+    def flush(self, file_name: str = None):
+        """write the queued points of the data file, or of all files, a failed write is queued again"""
+        with self._flush_lock:
+            with self._lock:
+                if file_name is None:
+                    pending, self._pending = self._pending, {}
+                else:
+                    pending = {data_file_name(file_name): self._pending.pop(data_file_name(file_name), [])}
+            for name, lines in pending.items():
+                if not lines:
+                    continue
+                try:
+                    append_data_lines(name, lines)
+                except Exception as e:
+                    with self._lock:
+                        lines = lines + self._pending.get(name, [])
+                        dropped = max(len(lines) - self.max_pending, 0)
+                        self._pending[name] = lines[dropped:]
+                    self._report(f"Error appending to '{data_log_name(name)}': {e}, "
+                                 f"{len(lines) - dropped} points queued again, {dropped} dropped")
+
+    def _report(self, message: str):
+        if callable(self.on_error):
+            self.on_error(message)
+        else:
+            warnings.warn(message, RuntimeWarning)
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.flush_seconds if self.flush_seconds > 0 else 1):
+            self.flush()
+
+    def close(self):
+        """stop the background thread and write the queued points"""
+        self._closed.set()
+        self.flush()
+
+
+data_writer = DataWriter()
+atexit.register(data_writer.close)
+
+
+def data_file_version(file_name: str) -> tuple:
+    """(mtime_ns, size) of the data file and of its log, None for a missing one, changes whenever the data does"""
+    if data_store is not None:
+        return data_store.version(file_name), None
+    version = []
+    for path in (os.path.join(data_folder_path, data_file_name(file_name)),
+                 os.path.join(data_folder_path, data_log_name(file_name))):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            version.append(None)
+        else:
+            version.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(version)
+
+
+def data_column_file_path(file_name: str) -> str:
+    """path of the column file kept for a closed month, `<group>.<YYYYMM>.bin`"""
+    return os.path.join(data_folder_path, os.path.splitext(file_name)[0] + column_file_extension)
+
+
+def is_closed_month(file_name: str) -> bool:
+    """whether the month of the data file is over, so its data does not change anymore"""
+    return os.path.splitext(data_file_name(file_name))[0].rsplit('.', 1)[-1] < datetime.now().strftime('%Y%m')
+
+
+def write_data_columns(file_name: str, data_list: list[dict] = None) -> bool:
+    """
+    write the column file of the data file from data_list, its parsed data if None,
+    with the original point in front if it is not in the data, return False if the data file has a log or no data
+    """
+    file_path = os.path.join(data_folder_path, data_file_name(file_name))
+    if os.path.exists(os.path.join(data_folder_path, data_log_name(file_name))):
+        return False
+    with data_writer.file_lock(file_name):
+        stat = os.stat(file_path)
+        data_points = TrafficDataList(parse_data(file_name) if data_list is None else data_list)
+        if not len(data_points):
+            return False
+        with_original_point = data_points._with_original_point()
+        write_column_file(data_column_file_path(file_name), (stat.st_mtime_ns, stat.st_size),
+                          with_original_point.to_columns(), with_original_point._urls,
+                          len(with_original_point) - len(data_points))
+    return True
+
+
+def load_data_columns(file_name: str, add_original_point=True) -> ("TrafficDataList", None):
+    """the data of the data file from its column file, None if there is none matching the current data file"""
+    column_file_path = data_column_file_path(file_name)
+    if data_store is not None or not os.path.exists(column_file_path):
+        return None
+    version = data_file_version(file_name)
+    if version[0] is None or version[1] is not None:
+        return None
+    try:
+        column_file = ColumnFile(column_file_path)
+    except Exception as e:
+        warnings.warn(f"Error reading column file '{column_file_path}': {e}")
+        return None
+    if not column_file.is_current(version[0]):
+        column_file.close()
+        return None
+    # the list keeps the file open, the mapping is closed once the list is not referenced anymore
+    return TrafficDataList.from_column_file(column_file, add_original_point=add_original_point)
 
 
 def list_data_file_name(keep_extension: bool = True) -> list[str]:
-    return [(file.name if keep_extension else os.path.splitext(file.name)[0])
-            for file in os.scandir(data_folder_path)
-            if file.is_file() and file.name.endswith('.json')]
+    if data_store is not None:
+        names = data_store.list_file_names()
+    else:
+        names = dict.fromkeys(data_file_name(file.name) for file in list_data_file())
+    return [(name if keep_extension else os.path.splitext(name)[0]) for name in names]
 
 
 def list_data_file() -> list[os.DirEntry]:
+    """data files and logs"""
     return [file for file in os.scandir(data_folder_path)
-            if file.is_file() and file.name.endswith('.json')]
+            if file.is_file() and file.name.endswith((data_file_extension, data_log_extension))]
 
 
 def newest_data_file(with_extension: bool = False) -> str:
+    if data_store is not None:
+        name = data_store.list_file_names()[-1]
+        return name if with_extension else os.path.splitext(name)[0]
     files = list_data_file()
     files.sort(key=lambda x: x.stat().st_mtime)
-    return files[-1].name if with_extension else os.path.splitext(files[-1].name)[0]
+    return data_file_name(files[-1].name) if with_extension else os.path.splitext(files[-1].name)[0]
+
+
+def use_sqlite_store(path: str = None, import_json: bool = True):
+    """
+    keep the data in the sqlite database at path, data/traffic.sqlite3 by default, instead of the data files.
+    If import_json, the data files not in the database yet are imported first, the files are left in place
+    """
+    global data_store
+    from sqlite_store import SQLiteStore
+    store = SQLiteStore(os.path.join(data_folder_path, "traffic.sqlite3") if path is None else path)
+    if import_json:
+        import_data_files(store)
+    data_writer.flush()
+    data_store = store
+    traffic_data_cache.invalidate()
+
+
+def import_data_files(store) -> list[str]:
+    """copy the data files and their logs into the store, skipping the files it already has"""
+    imported = []
+    for file_name in dict.fromkeys(data_file_name(file.name) for file in list_data_file()):
+        if store.has(file_name):
+            continue
+        file_path = os.path.join(data_folder_path, file_name)
+        log_path = os.path.join(data_folder_path, data_log_name(file_name))
+        data = list(parse_json(file_path)) if os.path.exists(file_path) else []
+        if os.path.exists(log_path):
+            data.extend(parse_json_lines(log_path))
+        store.write(file_name, data)
+        imported.append(file_name)
+    return imported
 
 
 # This is a data point sample
@@ -276,7 +630,7 @@ class GranDataPoint(BaseDataPoint):
         return f"GranDataPoint({self.date_in_str}, {self.pre_point.__repr__()}, {self.next_point.__repr__()})"
 
 
-class BaseDataList(list, ABC):
+class BaseDataList(Sequence, ABC):
     @abstractmethod
     def get_upload(self):
         pass
@@ -332,55 +686,243 @@ class BaseDataList(list, ABC):
         pass
 
 
+def _copy_column(column: (array, memoryview)) -> array:
+    """a copy of the column in a new array, which no view refers to"""
+    return array(column.typecode if isinstance(column, array) else column.format, column)
+
+
 class TrafficDataList(BaseDataList):
-    def __init__(self, data_list: (Iterable, BaseDataPoint) = None, *args):
-        if isinstance(data_list, TrafficDataPoint):
+    """
+    Time-ordered traffic data points stored by columns in contiguous arrays,
+    TrafficDataPoint objects are only materialized on indexing or iterating.
+    Date ranges and slices are views sharing the arrays, appending to the list while views are alive
+    or to a view copies the columns first, so the views keep the points they were taken of.
+    """
+
+    def __init__(self, data_list: (Iterable, BaseDataPoint) = None, *args, gmt_offset=0):
+        if isinstance(data_list, BaseDataPoint):
             data_list = [data_list]
             data_list.extend(args)
-        super().__init__()
+        self.gmt_offset = gmt_offset
+        self._urls: list[str] = []  # url table, referenced by _url_index
+        self._url_lookup: dict[str, int] = {}
+        self._url_index = array('l')
+        self._date_in_ts = array('d')
+        self._upload = array('q')
+        self._download = array('q')
+        self._total = array('q')
+        self._expire_in_ts = array('d')  # nan if missing
+        self._column_file: (ColumnFile, None) = None  # the file the columns map into, see from_column_file
         if data_list:
             self.extend(data_list)
 
+    def _url_id(self, url: str) -> int:
+        url_id = self._url_lookup.get(url)
+        if url_id is None:
+            url_id = self._url_lookup[url] = len(self._urls)
+            self._urls.append(url)
+        return url_id
+
+    def _copy_columns(self):
+        self._url_index, self._date_in_ts, self._upload, self._download, self._total, self._expire_in_ts = map(
+            _copy_column, (self._url_index, self._date_in_ts, self._upload, self._download, self._total,
+                           self._expire_in_ts))
+
+    def _append_columns(self, url, date_in_ts, upload, download, total, expire_in_ts):
+        url_id = self._url_id(url)
+        if isinstance(self._date_in_ts, memoryview):
+            self._copy_columns()
+        try:
+            self._url_index.append(url_id)
+        except BufferError:
+            # the arrays can't grow while views are exported
+            self._copy_columns()
+            self._url_index.append(url_id)
+        self._date_in_ts.append(date_in_ts)
+        self._upload.append(upload)
+        self._download.append(download)
+        self._total.append(total)
+        self._expire_in_ts.append(nan if expire_in_ts is None else expire_in_ts)
+
+    def _append_dict(self, data_point_dict: dict):
+        """append a parsed data point, the gmt offset of the list is applied"""
+        date_in_str = data_point_dict.get("date")
+        if date_in_str is None:
+            if data_point_dict.get("date_in_ts") is None:
+                warnings.warn(f"Missing information: date of {data_point_dict}")
+                return
+            date = datetime.fromtimestamp(data_point_dict.get("date_in_ts"))
+        else:
+            date = datetime.fromisoformat(date_in_str)
+        expire_in_ts = data_point_dict.get("expire")
+        if expire_in_ts is None:
+            warnings.warn(f"Missing information: expire time of {data_point_dict}")
+        elif self.gmt_offset:
+            expire_in_ts = (datetime.fromtimestamp(expire_in_ts) + timedelta(hours=self.gmt_offset)).timestamp()
+        self._append_columns(data_point_dict.get("url"), (date + timedelta(hours=self.gmt_offset)).timestamp(),
+                             data_point_dict.get("upload"), data_point_dict.get("download"),
+                             data_point_dict.get("total"), expire_in_ts)
+
+    def append(self, data_point: (BaseDataPoint, dict)):
+        if isinstance(data_point, dict):
+            self._append_dict(data_point)
+            return
+        if data_point.date_in_ts is None:
+            return
+        self._append_columns(data_point.url, data_point.date_in_ts, data_point.upload, data_point.download,
+                             data_point.total, data_point.expire_in_ts)
+
+    def extend(self, data_list: Iterable[BaseDataPoint | dict]):
+        for data_point in data_list:
+            self.append(data_point)
+
+    def _take(self, indices: Iterable[int]) -> "TrafficDataList":
+        """a new list of the points at the indices"""
+        taken = TrafficDataList(gmt_offset=self.gmt_offset)
+        for index in indices:
+            taken._append_columns(self._urls[self._url_index[index]], self._date_in_ts[index], self._upload[index],
+                                  self._download[index], self._total[index], self._expire_in_ts[index])
+        return taken
+
+    def _view(self, start: int, stop: int) -> "TrafficDataList":
+        """a zero-copy view of the points from start to before stop, copied on the first append"""
+        view = TrafficDataList(gmt_offset=self.gmt_offset)
+        view._urls, view._url_lookup, view._column_file = self._urls, self._url_lookup, self._column_file
+        view._url_index = memoryview(self._url_index)[start:stop]
+        view._date_in_ts = memoryview(self._date_in_ts)[start:stop]
+        view._upload = memoryview(self._upload)[start:stop]
+        view._download = memoryview(self._download)[start:stop]
+        view._total = memoryview(self._total)[start:stop]
+        view._expire_in_ts = memoryview(self._expire_in_ts)[start:stop]
+        return view
+
+    def _point(self, index: int) -> TrafficDataPoint:
+        expire_in_ts = self._expire_in_ts[index]
+        point = TrafficDataPoint({
+            "url": self._urls[self._url_index[index]],
+            "date_in_ts": self._date_in_ts[index],
+            "upload": self._upload[index],
+            "download": self._download[index],
+            "total": self._total[index],
+            "expire": None if isnan(expire_in_ts) else expire_in_ts
+        })
+        point.gmt_offset = self.gmt_offset
+        return point
+
+    @property
+    def nbytes(self) -> int:
+        """approximate memory used by the columns"""
+        return (sum(len(column) * column.itemsize for column in (
+            self._url_index, self._date_in_ts, self._upload, self._download, self._total, self._expire_in_ts))
+                + sum(len(url) for url in self._urls if url))
+
+    def __len__(self):
+        return len(self._date_in_ts)
+
+    def __getitem__(self, index: (int, slice)):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            return self._view(start, max(start, stop)) if step == 1 else self._take(range(start, stop, step))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("TrafficDataList index out of range")
+        return self._point(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self._point(index)
+
+    def __repr__(self):
+        return f"TrafficDataList({list(self)})"
+
     @classmethod
     def from_list(cls, data_list: list, gmt_offset=0, add_original_point=True):
-        data_points = [TrafficDataPoint(data_point_dict, gmt_offset=gmt_offset) for data_point_dict in data_list]
-        current_month = data_points[0].date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        data_points = cls(gmt_offset=gmt_offset)
+        for data_point_dict in data_list:
+            data_points._append_dict(data_point_dict)
+        return data_points._with_original_point() if add_original_point else data_points
+
+    @classmethod
+    def from_column_file(cls, column_file: ColumnFile, add_original_point=True):
+        """
+        the columns of a column file as memoryviews into its mapping without copying, with a gmt offset of 0.
+        The list keeps the file open and copies the columns on the first append, like a view
+        """
+        data_points = cls()
+        data_points._column_file = column_file
+        data_points._urls = list(column_file.urls)
+        data_points._url_lookup = {url: i for i, url in enumerate(data_points._urls)}
+        start = 0 if add_original_point else column_file.added_rows
+        columns = {name: column[start:] for name, column in column_file.columns.items()}
+        url_index = columns["url_index"]
+        data_points._url_index = url_index.cast('B').cast('l') if array('l').itemsize == 8 else array('l', url_index)
+        data_points._date_in_ts = columns["date_in_ts"]
+        data_points._upload = columns["upload"]
+        data_points._download = columns["download"]
+        data_points._total = columns["total"]
+        data_points._expire_in_ts = columns["expire_in_ts"]
+        return data_points
+
+    def to_columns(self) -> dict[str, array]:
+        """the columns for a column file"""
+        return {"date_in_ts": self._date_in_ts, "upload": self._upload, "download": self._download,
+                "total": self._total, "expire_in_ts": self._expire_in_ts, "url_index": self._url_index}
+
+    def _with_original_point(self) -> "TrafficDataList":
+        """the list starting with a point of no traffic at the start of the month, unless it has one already"""
+        current_month = datetime.fromtimestamp(self._date_in_ts[0]).replace(
+            day=1, hour=0, minute=0, second=0, microsecond=0)
         current_month_ts = current_month.timestamp()
-        if add_original_point and not [data_point for data_point in data_points
-                                       if data_point.date_in_ts == current_month_ts]:
-            """
-            self.url = data_point.get("url")
-            self.date_in_str = data_point.get("date")
-            self.upload = data_point.get("upload")
-            self.download = data_point.get("download")
-            self.total = data_point.get("total")
-            self.expire_in_ts = data_point.get("expire")
-            """
-            original_point = TrafficDataPoint({
-                "url": data_points[0].url,
-                "date": current_month.strftime("%Y-%m-%d %H:%M:%S"),
-                "upload": 0,
-                "download": 0,
-                "total": data_points[0].total,
-                "expire": data_points[0].expire_in_ts
-            })
-            data_points.insert(0, original_point)
-        return cls(data_points)
+        if current_month_ts in self._date_in_ts:
+            return self
+        original_point = type(self)(gmt_offset=self.gmt_offset)
+        original_point._append_columns(self._urls[self._url_index[0]], current_month_ts, 0, 0,
+                                       self._total[0], self._expire_in_ts[0])
+        original_point._extend_columns(self)
+        return original_point
+
+    def _extend_columns(self, other: "TrafficDataList"):
+        """extend by another TrafficDataList without materializing its points"""
+        url_ids = [self._url_id(url) for url in other._urls]
+        if url_ids == list(range(len(url_ids))):
+            url_index = other._url_index
+        else:
+            url_index = array('l', (url_ids[i] for i in other._url_index))
+        if isinstance(self._date_in_ts, memoryview):
+            self._copy_columns()
+        try:
+            self._url_index.extend(url_index)
+        except BufferError:
+            # the arrays can't grow while views are exported
+            self._copy_columns()
+            self._url_index.extend(url_index)
+        self._date_in_ts.extend(other._date_in_ts)
+        self._upload.extend(other._upload)
+        self._download.extend(other._download)
+        self._total.extend(other._total)
+        self._expire_in_ts.extend(other._expire_in_ts)
+
+    def copy(self) -> "TrafficDataList":
+        """a modifiable copy of the columns"""
+        copied = TrafficDataList(gmt_offset=self.gmt_offset)
+        copied._extend_columns(self)
+        return copied
 
     def get_upload(self):
-        return [data_point.upload for data_point in self]
+        return self._upload.tolist()
 
     def get_download(self):
-        return [data_point.download for data_point in self]
+        return self._download.tolist()
 
     def get_total_traffic(self):
-        return [data_point.total_traffic for data_point in self]
+        return [upload + download for upload, download in zip(self._upload, self._download)]
 
-    def get_additional_upload(self):
+    @staticmethod
+    def _additional(column: Iterable) -> list:
         pre_total = None
         result = []
-        for data_point in self:
-            point_total = data_point.get("upload")
+        for point_total in column:
             if pre_total is None:
                 result.append(0)
             else:
@@ -389,88 +931,91 @@ class TrafficDataList(BaseDataList):
             pre_total = point_total
         return result
 
+    def get_additional_upload(self):
+        return self._additional(self._upload)
+
     def get_additional_download(self):
-        pre_total = None
-        result = []
-        for data_point in self:
-            point_total = data_point.get("download")
-            if pre_total is None:
-                result.append(0)
-            else:
-                result.append((point_total - pre_total)
-                              if allow_negative_traffic or point_total > pre_total else 0)
-            pre_total = point_total
-        return result
+        return self._additional(self._download)
 
     def get_additional_total_traffic(self):
-        pre_total = None
-        result = []
-        for data_point in self:
-            point_total = data_point.total_traffic
-            if pre_total is None:
-                result.append(0)
-            else:
-                result.append((point_total - pre_total)
-                              if allow_negative_traffic or point_total > pre_total else 0)
-            pre_total = point_total
-        return result
+        return self._additional(self.get_total_traffic())
 
     def get_attr_total(self):
-        return [data_point.total for data_point in self]
+        return self._total.tolist()
 
     def get_date(self) -> list[datetime]:
-        return [data_point.date for data_point in self]
+        return [datetime.fromtimestamp(date_in_ts) for date_in_ts in self._date_in_ts]
 
     def get_date_in_str(self, date_format="%Y-%m-%d %H:%M:%S") -> list[str]:
-        return [data_point.date.strftime(date_format) for data_point in self]
+        return [datetime.fromtimestamp(date_in_ts).strftime(date_format) for date_in_ts in self._date_in_ts]
 
     def get_date_in_ts(self) -> list[float]:
-        return [data_point.date_in_ts for data_point in self]
+        return self._date_in_ts.tolist()
 
-    def get_data_by_url(self, url: str) -> list[BaseDataPoint]:
-        return TrafficDataList(point for point in self if point.url == url)
+    def get_data_by_url(self, url: str) -> "TrafficDataList":
+        url_id = self._url_lookup.get(url)
+        return self._take(index for index, point_url_id in enumerate(self._url_index) if point_url_id == url_id)
 
     def get_data_by_date_range(self, start_date: datetime = None, end_date: datetime = None):
-        """return a list of TrafficDataPoint from start_date to before end_date"""
-        if start_date is None:
-            start_date = self[0].date
-        if end_date is None:
-            end_date = self[-1].date + timedelta(microseconds=1)
-        return TrafficDataList([point for point in self if start_date <= point.date < end_date])
+        """return a view of the TrafficDataPoint from start_date to before end_date"""
+        start = 0 if start_date is None else bisect_left(self._date_in_ts, start_date.timestamp())
+        stop = len(self) if end_date is None else bisect_left(self._date_in_ts, end_date.timestamp())
+        return self._view(start, max(start, stop))
 
     def get_data_by_gran(self, start_date: datetime = None, end_date: datetime = None,
                          granularity_sec: (int, None) = None) -> ("GranDataList", None):
+        """
+        resample the data on a timestamp grid from start_date by granularity_sec,
+        grid timestamps between two points are linearly interpolated
+        """
         if start_date is None:
             start_date = self[0].date
         if end_date is None:
             end_date = self[-1].date
-        result_data = list()
 
         if granularity_sec is None:
             return GranDataList(self.get_data_by_date_range(start_date, end_date))
 
+        result_data = GranDataList(granularity_sec=granularity_sec)
+        result_data._source = self
+        dates_in_ts, uploads, downloads, totals = self._date_in_ts, self._upload, self._download, self._total
+        if not len(dates_in_ts):
+            return result_data
         current_timestamp = start_date.timestamp()
         end_timestamp = end_date.timestamp()
-        pre_point = None
-        for point in self:
-            if current_timestamp <= point.date_in_ts:
-                # while current_timestamp < point.date_in_ts:
-                while current_timestamp < point.date_in_ts and current_timestamp < end_timestamp:
-                    result_data.append(GranDataPoint(pre_point, point, current_timestamp)
-                                       if pre_point is not None else point)
-                    current_timestamp += granularity_sec
-                if current_timestamp == point.date_in_ts:
-                    result_data.append(point)
-                    current_timestamp += granularity_sec
-                pre_point = point
-            else:
-                pre_point = point
-                continue
-            # current_timestamp += granularity_sec
+        count = len(dates_in_ts)
+        # the first point at or after the current timestamp, the one before it interpolates the grid timestamps
+        index = bisect_left(dates_in_ts, current_timestamp)
+        pre_index = index - 1 if index else None
+        while index < count:
+            date_in_ts = dates_in_ts[index]
+            while current_timestamp < date_in_ts and current_timestamp < end_timestamp:
+                if pre_index is None:
+                    # no point before, take the point itself
+                    result_data._append_columns(date_in_ts, uploads[index], downloads[index], totals[index],
+                                                index, index)
+                else:
+                    w1 = date_in_ts - current_timestamp
+                    w2 = current_timestamp - dates_in_ts[pre_index]
+                    result_data._append_columns(
+                        current_timestamp,
+                        (uploads[pre_index] * w1 + uploads[index] * w2) / (w1 + w2),
+                        (downloads[pre_index] * w1 + downloads[index] * w2) / (w1 + w2),
+                        int((totals[pre_index] * w1 + totals[index] * w2) / (w1 + w2)),
+                        pre_index, index)
+                current_timestamp += granularity_sec
+            if current_timestamp == date_in_ts:
+                result_data._append_columns(date_in_ts, uploads[index], downloads[index], totals[index],
+                                            index, index)
+                current_timestamp += granularity_sec
             if current_timestamp >= end_timestamp:
                 break
+            # skip the points before the current timestamp, the last of them is the next pre point
+            next_index = bisect_left(dates_in_ts, current_timestamp, index + 1)
+            pre_index = next_index - 1
+            index = next_index
 
-        return GranDataList(result_data, granularity_sec=granularity_sec)
+        return result_data
 
     def get_data_by_count(self, _count: int, start_date: datetime = None, end_date: datetime = None) -> (
             "GranDataList", None):
@@ -500,90 +1045,164 @@ class TrafficDataList(BaseDataList):
         return self.get_data_by_date_range(start_date=start_of_latest_24hours, end_date=datetime.now())
 
 
-class GranDataList(list):
-    def __init__(self, items: Iterable[GranDataPoint | TrafficDataPoint],
+class GranDataList(Sequence):
+    """
+    Data points resampled by granularity, the upload, download and total series are precomputed
+    in contiguous arrays, GranDataPoint and TrafficDataPoint objects are only materialized on indexing.
+    Each item refers to its pre and next point in the source TrafficDataList, equal for an original point.
+    Like TrafficDataList, appending while views are alive or to a view copies the columns first.
+    """
+
+    def __init__(self, items: Iterable[GranDataPoint | TrafficDataPoint] = None,
                  granularity_sec: int = None):
-        super().__init__()
-        if not all(isinstance(item, (GranDataPoint, TrafficDataPoint)) for item in items):
-            raise ValueError("items must be TrafficDataPoint or GranDataPoint")
-        self.extend(items)
         if granularity_sec is None:
             granularity_sec = 1
         self.granularity_sec = granularity_sec
-
-    def get_pre_points(self) -> list[TrafficDataPoint]:
-        lst = []
-        for item in self:
+        self._date_in_ts = array('d')
+        self._upload = array('d')
+        self._download = array('d')
+        self._total = array('q')
+        self._pre_index = array('l')
+        self._next_index = array('l')
+        if isinstance(items, TrafficDataList):
+            self._source = items
+            self._date_in_ts.extend(items._date_in_ts)
+            self._upload.extend(map(float, items._upload))
+            self._download.extend(map(float, items._download))
+            self._total.extend(items._total)
+            self._pre_index.extend(range(len(items)))
+            self._next_index.extend(range(len(items)))
+            return
+        self._source = TrafficDataList()
+        source_index: dict[int, int] = {}  # id of the point -> index in source
+
+        def _index(point: TrafficDataPoint) -> int:
+            if id(point) not in source_index:
+                source_index[id(point)] = len(self._source)
+                self._source.append(point)
+            return source_index[id(point)]
+
+        for item in items or ():
             if isinstance(item, GranDataPoint):
-                lst.append(item.pre_point)
+                self._append_columns(item.date_in_ts, item.upload, item.download, item.total,
+                                     _index(item.pre_point), _index(item.next_point))
             elif isinstance(item, TrafficDataPoint):
-                lst.append(item)
-        return lst
+                self._append_columns(item.date_in_ts, item.upload, item.download, item.total,
+                                     _index(item), _index(item))
+            else:
+                raise ValueError("items must be TrafficDataPoint or GranDataPoint")
+
+    def _copy_columns(self):
+        self._date_in_ts, self._upload, self._download, self._total, self._pre_index, self._next_index = map(
+            _copy_column, (self._date_in_ts, self._upload, self._download, self._total, self._pre_index,
+                           self._next_index))
+
+    def _append_columns(self, date_in_ts, upload, download, total, pre_index, next_index):
+        if isinstance(self._date_in_ts, memoryview):
+            self._copy_columns()
+        try:
+            self._date_in_ts.append(date_in_ts)
+        except BufferError:
+            # the arrays can't grow while views are exported
+            self._copy_columns()
+            self._date_in_ts.append(date_in_ts)
+        self._upload.append(upload)
+        self._download.append(download)
+        self._total.append(total)
+        self._pre_index.append(pre_index)
+        self._next_index.append(next_index)
+
+    def _take(self, indices: Iterable[int]) -> "GranDataList":
+        """a new list of the items at the indices"""
+        taken = GranDataList(granularity_sec=self.granularity_sec)
+        taken._source = self._source
+        for index in indices:
+            taken._append_columns(self._date_in_ts[index], self._upload[index], self._download[index],
+                                  self._total[index], self._pre_index[index], self._next_index[index])
+        return taken
+
+    def _view(self, start: int, stop: int) -> "GranDataList":
+        """a zero-copy view of the items from start to before stop, copied on the first append"""
+        view = GranDataList(granularity_sec=self.granularity_sec)
+        view._source = self._source
+        view._date_in_ts = memoryview(self._date_in_ts)[start:stop]
+        view._upload = memoryview(self._upload)[start:stop]
+        view._download = memoryview(self._download)[start:stop]
+        view._total = memoryview(self._total)[start:stop]
+        view._pre_index = memoryview(self._pre_index)[start:stop]
+        view._next_index = memoryview(self._next_index)[start:stop]
+        return view
+
+    def _item(self, index: int) -> GranDataPoint | TrafficDataPoint:
+        pre_index, next_index = self._pre_index[index], self._next_index[index]
+        if pre_index == next_index:
+            return self._source[pre_index]
+        return GranDataPoint(self._source[pre_index], self._source[next_index], self._date_in_ts[index])
+
+    def __len__(self):
+        return len(self._date_in_ts)
+
+    def __getitem__(self, index: (int, slice)):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            return self._view(start, max(start, stop)) if step == 1 else self._take(range(start, stop, step))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("GranDataList index out of range")
+        return self._item(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self._item(index)
+
+    def __repr__(self):
+        return f"GranDataList({list(self)})"
+
+    def get_pre_points(self) -> list[TrafficDataPoint]:
+        return [self._source[index] for index in self._pre_index]
 
     def get_next_points(self) -> list[TrafficDataPoint]:
-        lst = []
-        for item in self:
-            if isinstance(item, GranDataPoint):
-                lst.append(item.next_point)
-            elif isinstance(item, TrafficDataPoint):
-                lst.append(item)
-            else:
-                continue
-        return lst
+        return [self._source[index] for index in self._next_index]
 
     def get_date(self) -> list[datetime]:
-        return [item.date for item in self]
+        return [datetime.fromtimestamp(date_in_ts) for date_in_ts in self._date_in_ts]
 
     def get_date_in_str(self, date_format="%Y-%m-%d %H:%M:%S") -> list[str]:
-        return [item.date.strftime(date_format) for item in self]
+        return [datetime.fromtimestamp(date_in_ts).strftime(date_format) for date_in_ts in self._date_in_ts]
 
     def get_date_in_ts(self) -> list[float]:
-        return [item.date_in_ts for item in self]
+        return self._date_in_ts.tolist()
 
     def get_upload(self) -> list[float]:
-        return [item.upload for item in self]
+        return self._upload.tolist()
 
     def get_download(self) -> list[float]:
-        return [item.download for item in self]
+        return self._download.tolist()
 
     def get_total_traffic(self) -> list[float]:
-        return [item.total_traffic for item in self]
+        return [upload + download for upload, download in zip(self._upload, self._download)]
 
-    def get_additional_upload(self) -> list[float]:
-        if len(self) < 1:
+    @staticmethod
+    def _additional(column: Sequence) -> list[float]:
+        if len(column) < 1:
             return []
-        pre_point_upload = self[0].upload
+        pre_point_total = column[0]
         result = []
-        for point in self:
-            point_upload = point.upload
-            result.append((point_upload - pre_point_upload)
-                          if allow_negative_traffic or point_upload > pre_point_upload else 0)
-            pre_point_upload = point_upload
+        for point_total in column:
+            result.append((point_total - pre_point_total)
+                          if allow_negative_traffic or point_total > pre_point_total else 0)
+            pre_point_total = point_total
         return result
 
+    def get_additional_upload(self) -> list[float]:
+        return self._additional(self._upload)
+
     def get_additional_download(self) -> list[float]:
-        if len(self) < 1:
-            return []
-        pre_point_download = self[0].download
-        result = []
-        for point in self:
-            point_download = point.download
-            result.append((point_download - pre_point_download)
-                          if allow_negative_traffic or point_download > pre_point_download else 0)
-            pre_point_download = point_download
-        return result
+        return self._additional(self._download)
 
     def get_additional_total_traffic(self) -> list[float]:
-        if len(self) < 1:
-            return []
-        pre_point_total = self[0].total_traffic
-        result = []
-        for point in self:
-            point_total = point.total_traffic
-            result.append((point_total - pre_point_total)
-                          if allow_negative_traffic or point_total > pre_point_total else 0)
-            pre_point_total = point_total
-        return result
+        return self._additional(self.get_total_traffic())
 
     def get_upload_rate_sec(self) -> list[float]:
         if len(self) < 1:
@@ -600,31 +1219,18 @@ class GranDataList(list):
             return []
         return [additional / self.granularity_sec for additional in self.get_additional_total_traffic()]
 
-    def get_data_by_date_range(self, start_date: datetime = None, end_date: datetime = None) -> TrafficDataList:
-        """return a list of TrafficDataPoint from start_date to before end_date"""
-        if start_date is None:
-            start_date = self[0].date
-        if end_date is None:
-            end_date = self[-1].date + timedelta(microseconds=1)
-        return TrafficDataList([point for point in self if start_date <= point.date < end_date])
+    def get_data_by_date_range(self, start_date: datetime = None, end_date: datetime = None) -> "GranDataList":
+        """return a view of the GranDataPoint and TrafficDataPoint from start_date to before end_date"""
+        start = 0 if start_date is None else bisect_left(self._date_in_ts, start_date.timestamp())
+        stop = len(self) if end_date is None else bisect_left(self._date_in_ts, end_date.timestamp())
+        return self._view(start, max(start, stop))
 
     def get_data_by_gran(self, start_date: datetime = None, end_date: datetime = None,
                          granularity_sec: int = None) -> "GranDataList":
-        points = []
-        recorded_date = []
-        for point in self:
-            if isinstance(point, TrafficDataPoint) and point.date_in_ts not in recorded_date:
-                points.append(point)
-                recorded_date.append(point.date)
-            elif isinstance(point, GranDataPoint) and point.date not in recorded_date:
-                if point.pre_point.date_in_ts not in recorded_date:
-                    points.append(point.pre_point)
-                    recorded_date.append(point.pre_point.date_in_ts)
-                if point.next_point.date_in_ts not in recorded_date:
-                    points.append(point.next_point)
-                    recorded_date.append(point.next_point.date_in_ts)
-        return TrafficDataList(points).get_data_by_gran(start_date=start_date, end_date=end_date,
-                                                        granularity_sec=granularity_sec)
+        """resample again from the source points the items are interpolated from"""
+        indices = sorted(set(self._pre_index).union(self._next_index))
+        return self._source._take(indices).get_data_by_gran(start_date=start_date, end_date=end_date,
+                                                            granularity_sec=granularity_sec)
 
     def get_data_by_count(self, _count: int, start_date: datetime = None, end_date: datetime = None) -> "GranDataList":
         if _count <= 0:
@@ -636,23 +1242,135 @@ class GranDataList(list):
         _granularity = (end_date - start_date).total_seconds() / _count
         return self.get_data_by_gran(start_date=start_date, end_date=end_date, granularity_sec=_granularity)
 
-    def latest_month_data(self) -> "TrafficDataList":
+    def latest_month_data(self) -> "GranDataList":
         start_of_latest_month = self[-1].date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
         return self.get_data_by_date_range(start_date=start_of_latest_month, end_date=datetime.now())
 
-    def latest_7days_data(self) -> "TrafficDataList":
+    def latest_7days_data(self) -> "GranDataList":
         start_of_latest_month = self[-1].date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
         start_of_latest_7days = (self[-1].date - timedelta(days=7)) if (
                 (self[-1].date - start_of_latest_month).days > 7) else start_of_latest_month
         return self.get_data_by_date_range(start_date=start_of_latest_7days, end_date=datetime.now())
 
-    def latest_24hours_data(self) -> "TrafficDataList":
+    def latest_24hours_data(self) -> "GranDataList":
         start_of_latest_month = self[-1].date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
         start_of_latest_24hours = (self[-1].date - timedelta(hours=24)) if (
                 (self[-1].date - start_of_latest_month).days > 1) else start_of_latest_month
         return self.get_data_by_date_range(start_date=start_of_latest_24hours, end_date=datetime.now())
 
 
+class TrafficDataCache:
+    """
+    Process-wide LRU cache of parsed TrafficDataList by data file,
+    an entry is valid while the data_file_version of its file is unchanged.
+    An entry also keeps the byte offset parsed up to in the log of the file for tail loading.
+    """
+
+    def __init__(self, max_entries: int = 32, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.tail_loads = 0
+        self._entries: OrderedDict[tuple, tuple[tuple, TrafficDataList, int]] = OrderedDict()
+        self._nbytes = 0
+        self._lock = Lock()
+
+    def get(self, key: tuple, version: tuple) -> (TrafficDataList, None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def entry(self, key: tuple) -> (tuple[tuple, TrafficDataList, int], None):
+        """(version, data, log offset) of the key even if outdated"""
+        with self._lock:
+            return self._entries.get(key)
+
+    def put(self, key: tuple, version: tuple, data: TrafficDataList, log_offset: int = 0):
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (version, data, log_offset)
+            self._nbytes += data.nbytes
+            while self._entries and (len(self._entries) > self.max_entries or self._nbytes > self.max_bytes):
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _pop(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._nbytes -= entry[1].nbytes
+
+    def invalidate(self, file_name: str = None):
+        """drop the entries of the data file, or all entries"""
+        with self._lock:
+            for key in list(self._entries):
+                if file_name is None or key[0] == data_file_name(file_name):
+                    self._pop(key)
+
+    def info(self) -> dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "tail_loads": self.tail_loads,
+                    "evictions": self.evictions,
+                    "entries": len(self._entries), "bytes": self._nbytes,
+                    "max_entries": self.max_entries, "max_bytes": self.max_bytes}
+
+
+traffic_data_cache = TrafficDataCache()
+
+
+def load_traffic_data(file_name: str, gmt_offset=0, add_original_point=True) -> TrafficDataList:
+    """
+    parse the data file into a TrafficDataList through traffic_data_cache,
+    the returned list is shared and must not be modified.
+    A closed month is read from its column file, which is written on its first parse.
+    If only the log of the file has grown, just its new tail is parsed and appended to a copy of the cached list,
+    it is reloaded in full if the file was rewritten.
+    """
+    key = (data_file_name(file_name), gmt_offset, add_original_point)
+    version = data_file_version(file_name)
+    data = traffic_data_cache.get(key, version)
+    if data is not None:
+        return data
+
+    entry = traffic_data_cache.entry(key)
+    if entry is not None:
+        cached_version, cached_data, log_offset = entry
+        log_version = version[1]
+        if cached_version[0] == version[0] and log_version is not None and log_version[1] >= log_offset:
+            try:
+                tail, log_offset = parse_data_log_tail(file_name, log_offset)
+            except FileNotFoundError:  # compacted meanwhile
+                pass
+            else:
+                data = cached_data.copy()
+                data.extend(tail)
+                traffic_data_cache.tail_loads += 1
+                traffic_data_cache.put(key, version, data, log_offset)
+                return data
+
+    if gmt_offset == 0:
+        data = load_data_columns(file_name, add_original_point)
+        if data is not None:
+            traffic_data_cache.put(key, version, data, 0)
+            return data
+
+    data_list, log_offset = parse_data_with_log_offset(file_name)
+    data = TrafficDataList.from_list(data_list, gmt_offset=gmt_offset, add_original_point=add_original_point)
+    traffic_data_cache.put(key, version, data, log_offset)
+    if data_store is None and version[1] is None and is_closed_month(file_name):
+        try:
+            write_data_columns(file_name, data_list)
+        except Exception as e:
+            warnings.warn(f"Error writing the column file of '{file_name}': {e}")
+    return data
+
+
 def traffic_to_gb_in_str(traffic, _prec=3) -> str:
     """
     Convert traffic from bytes to gigabytes and return the result as a string.
@@ -1,57 +1,461 @@
 import functools
+import heapq
+import itertools
+import json
+import os
+import random
 import time
+import traceback
+import warnings
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from threading import Condition, Lock
 from typing import Callable
 
-import schedule as schedule_lib
+_default_name_counts: dict[str, int] = {}
+_default_name_lock = Lock()
+
+
+def default_job_name(func: Callable) -> str:
+    """
+    the name of the function, numbered from its second registration on,
+    so the jobs of separate registrations are never taken for one another, like several lambdas
+    """
+    name = getattr(func, '__name__', repr(func))
+    with _default_name_lock:
+        count = _default_name_counts[name] = _default_name_counts.get(name, 0) + 1
+    return name if count == 1 else f"{name}#{count}"
+
+
+class Job:
+    """
+    a function to run every interval_seconds,
+    or if offset_seconds is given at offset_seconds past the full hour and then every interval_seconds.
+    Every run is delayed by a random jitter of up to jitter_seconds, due is when the next run is,
+    while next_run stays on the cadence.
+    Jobs of the same name never run at the same time, without a name every job is a name of its own.
+    """
+
+    def __init__(self, func: Callable, interval_seconds: float, offset_seconds: float = None, name: str = None,
+                 jitter_seconds: float = 0):
+        self.func = func
+        self.name = default_job_name(func) if name is None else name
+        self.interval_seconds = interval_seconds
+        self.offset_seconds = offset_seconds
+        self.jitter_seconds = jitter_seconds
+        self.last_run: (float, None) = None
+        self.next_run: float = self.first_run(time.time())
+        self.due: float = self.jittered(self.next_run)
+        self.cancelled = False
+
+    def jittered(self, next_run: float) -> float:
+        return next_run + random.uniform(0, self.jitter_seconds) if self.jitter_seconds else next_run
+
+    def first_run(self, now: float) -> float:
+        if self.offset_seconds is None:
+            return now + self.interval_seconds
+        hour_start = datetime.fromtimestamp(now).replace(minute=0, second=0, microsecond=0).timestamp()
+        next_run = hour_start + self.offset_seconds
+        while next_run <= now:
+            next_run += self.interval_seconds
+        return next_run
+
+    def schedule_next(self, now: float):
+        """move next_run to the first run after now on the cadence of the job, the runs missed are skipped"""
+        missed = max((now - self.next_run) // self.interval_seconds + 1, 1)
+        self.next_run += missed * self.interval_seconds
+        self.due = self.jittered(self.next_run)
+
+    def run(self):
+        self.last_run = time.time()
+        return self.func()
+
+    def __repr__(self):
+        at = "" if self.offset_seconds is None else \
+            f" from :{int(self.offset_seconds // 60):02d}:{int(self.offset_seconds % 60):02d}"
+        return (f"Job({self.name}, every {self.interval_seconds / 60:g} minutes{at}, "
+                f"next run {datetime.fromtimestamp(self.due).strftime('%Y-%m-%d %H:%M:%S')})")
+
+
+class JobQueue:
+    """jobs in a heap ordered by when they are due, a waiting scheduler is woken whenever the jobs change"""
+
+    def __init__(self):
+        self._heap: list[tuple[float, int, Job]] = []
+        self._counter = itertools.count()
+        self._condition = Condition()
+
+    def add(self, job: Job) -> Job:
+        with self._condition:
+            heapq.heappush(self._heap, (job.due, next(self._counter), job))
+            self._condition.notify_all()
+        return job
+
+    def reschedule(self, job: Job):
+        """put a job back after its run, unless it was cancelled meanwhile"""
+        with self._condition:
+            if not job.cancelled:
+                job.schedule_next(time.time())
+                self.add(job)
+
+    def move(self, job: Job, next_run: float):
+        """put the job on another cadence, at next_run or the first run after now on it"""
+        with self._condition:
+            self._heap = [entry for entry in self._heap if entry[2] is not job]
+            heapq.heapify(self._heap)
+            job.next_run = next_run
+            if next_run <= time.time():
+                job.schedule_next(time.time())
+            else:
+                job.due = job.jittered(next_run)
+            self.add(job)
+
+    def cancel(self, job: Job):
+        """the entry of the job is dropped lazily when it reaches the top of the heap"""
+        with self._condition:
+            job.cancelled = True
+            self._condition.notify_all()
+
+    def clear(self):
+        with self._condition:
+            for _, _, job in self._heap:
+                job.cancelled = True
+            self._heap.clear()
+            self._condition.notify_all()
+
+    def jobs(self) -> list[Job]:
+        with self._condition:
+            return [job for _, _, job in sorted(self._heap) if not job.cancelled]
+
+    def wake(self):
+        with self._condition:
+            self._condition.notify_all()
+
+    def pop_due(self, timeout: float = None) -> list[Job]:
+        """
+        sleep until the earliest job is due, a change of the jobs or at most timeout seconds,
+        then pop the jobs due, which may be none
+        """
+        with self._condition:
+            while self._heap and self._heap[0][2].cancelled:
+                heapq.heappop(self._heap)
+            delay = self._heap[0][0] - time.time() if self._heap else None
+            if timeout is not None:
+                delay = timeout if delay is None else min(delay, timeout)
+            if delay is None or delay > 0:
+                self._condition.wait(delay)
+            now = time.time()
+            due = []
+            while self._heap and (self._heap[0][2].cancelled or self._heap[0][0] <= now):
+                _, _, job = heapq.heappop(self._heap)
+                if not job.cancelled:
+                    due.append(job)
+            return due
+
+
+default_queue = JobQueue()
 
 
 def get_jobs() -> list:
-    return list(schedule_lib.get_jobs())
+    return default_queue.jobs()
+
+
+def spread_offset(name: str, interval_seconds: float, spread_seconds: float) -> float:
+    """a stable offset within the spread window for the name, so the jobs keep their place across restarts"""
+    window = min(spread_seconds, interval_seconds)
+    return zlib.crc32(name.encode()) % int(window) if window >= 1 else 0
+
+
+def make_jobs(func: Callable, interval_minutes, start_on_full_hour=False, name: str = None,
+              spread_seconds: float = 0, jitter_seconds: float = 0) -> list[Job]:
+    """
+    the jobs running the function every interval_minutes, or on the full hour and every interval_minutes after it,
+    all under the name, by default one of their own
+    """
+    if name is None:
+        name = default_job_name(func)
+    if start_on_full_hour:
+        offset = spread_offset(name, interval_minutes * 60, spread_seconds)
+        return [Job(func, 3600, offset_seconds=i * interval_minutes * 60 + offset, name=name,
+                    jitter_seconds=jitter_seconds)
+                for i in range(59 // interval_minutes + 1)]
+    return [Job(func, interval_minutes * 60, name=name, jitter_seconds=jitter_seconds)]
 
 
-def schedule(interval_minutes, start_on_full_hour=False, start_callback=None, end_callback=None) -> Callable:
+def schedule(interval_minutes, start_on_full_hour=False, start_callback=None, end_callback=None,
+             name: str = None, spread_seconds: float = 0, jitter_seconds: float = 0) -> Callable:
+    """
+    schedule the function every interval_minutes, or on the full hour and every interval_minutes after it.
+    The full hour jobs of different names are spread over the first spread_seconds of their interval,
+    every run is delayed by a random jitter of up to jitter_seconds.
+    """
+
     def decorator(func) -> Callable:
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             if callable(start_callback):
                 start_callback()
             _return = func(*args, **kwargs)
-            if callable(start_callback):
+            if callable(end_callback):
                 end_callback()
             return _return
 
-        if start_on_full_hour:
-            for i in range(59 // interval_minutes + 1):
-                schedule_lib.every().hour.at(f":{str(i * interval_minutes).zfill(2)}").do(wrapper)
-        else:
-            schedule_lib.every(interval_minutes).minutes.do(wrapper)
+        for job in make_jobs(wrapper, interval_minutes, start_on_full_hour, name, spread_seconds, jitter_seconds):
+            default_queue.add(job)
         return wrapper
 
     return decorator
 
 
+class JobRegistry:
+    """
+    the jobs of the queue per name with the arguments of make_jobs they were made with,
+    so they can be reconciled with a new set of names and arguments without touching the unchanged ones
+    """
+
+    def __init__(self, queue: JobQueue = None):
+        self.queue = default_queue if queue is None else queue
+        self._jobs: dict[str, tuple[dict, list[Job]]] = {}
+        self._lock = Lock()
+
+    def names(self) -> list[str]:
+        with self._lock:
+            return list(self._jobs)
+
+    def add(self, name: str, func: Callable, **kwargs):
+        """schedule func under the name with the arguments of make_jobs, replacing the jobs of the name"""
+        with self._lock:
+            self._cancel(name)
+            jobs = make_jobs(func, name=name, **kwargs)
+            self._jobs[name] = (kwargs, jobs)
+        for job in jobs:
+            self.queue.add(job)
+
+    def _cancel(self, name: str):
+        for job in self._jobs.pop(name, (None, []))[1]:
+            self.queue.cancel(job)
+
+    def cancel(self, name: str):
+        """cancel the jobs of the name, a run in progress is not interrupted"""
+        with self._lock:
+            self._cancel(name)
+
+    def reconcile(self, specs: dict[str, dict], func_factory: Callable[[str], Callable]) -> dict[str, list[str]]:
+        """
+        make the jobs match specs, the arguments of make_jobs per name:
+        the new names are added with the function func_factory(name), the names missing are cancelled
+        and the names whose arguments changed are scheduled again
+        """
+        with self._lock:
+            current = {name: kwargs for name, (kwargs, _) in self._jobs.items()}
+        changes = {"added": [], "removed": [], "changed": []}
+        for name in current.keys() - specs.keys():
+            self.cancel(name)
+            changes["removed"].append(name)
+        for name, kwargs in specs.items():
+            if name not in current:
+                changes["added"].append(name)
+            elif current[name] != kwargs:
+                changes["changed"].append(name)
+            else:
+                continue
+            self.add(name, func_factory(name), **kwargs)
+        return changes
+
+
+class SchedulerState:
+    """the last run and the next due time per job name, kept in a json file to survive restarts"""
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.jobs: dict[str, dict] = {}
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self.jobs = json.load(f)
+            except Exception as e:
+                warnings.warn(RuntimeWarning(f"Scheduler state not loaded: {e}"))
+
+    def last_run(self, name: str) -> (float, None):
+        return self.jobs.get(name, {}).get("last_run")
+
+    def next_due(self, name: str) -> (float, None):
+        return self.jobs.get(name, {}).get("next_due")
+
+    def update(self, name: str, last_run: float = None, next_due: float = None):
+        job = self.jobs.setdefault(name, {})
+        if last_run is not None:
+            job["last_run"] = last_run
+        if next_due is not None:
+            job["next_due"] = next_due
+
+    def save(self):
+        if self.path is None:
+            return
+        try:
+            with open(self.path + ".tmp", 'w') as f:
+                json.dump(self.jobs, f, indent=2)
+            os.replace(self.path + ".tmp", self.path)
+        except Exception as e:
+            warnings.warn(RuntimeWarning(f"Scheduler state not saved: {e}"))
+
+
 class Scheduler:
-    def __init__(self, interval_seconds=1, call_when_started=False):
+    """
+    dispatches the jobs of the queue to a pool of max_workers threads when they are due,
+    sleeping until the earliest one instead of polling. A sleep lasts at most interval_seconds,
+    so a change of the wall clock is noticed.
+    A job due while the previous run of its name is still in progress is skipped,
+    a run taking longer than job_timeout_seconds is reported, as is how late every run started.
+    The last run and next due time of every job name are kept in the file at state_path. On start the
+    interval jobs continue their saved cadence and a job that missed runs while stopped runs once to catch up.
+    The runs missed while the host was suspended are coalesced the same way, into one run per job name.
+    """
+
+    def __init__(self, interval_seconds=60, call_when_started=False, queue: JobQueue = None, max_workers=8,
+                 job_timeout_seconds: float = None, state_path: str = None):
         self.running = True
         self.interval_seconds = interval_seconds
         self.call_when_started = call_when_started
+        self.queue = default_queue if queue is None else queue
+        self.job_timeout_seconds = job_timeout_seconds
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._in_progress: dict[str, float] = {}  # name of the job -> start of its run
+        self._timed_out: set[str] = set()
+        self._stats: dict[str, dict] = {}
+        self._lock = Lock()
+        self.state = SchedulerState(state_path)
+
+    def _job_stats(self, name: str) -> dict:
+        return self._stats.setdefault(name, {"runs": 0, "skipped": 0, "failures": 0, "timeouts": 0,
+                                             "lateness": 0.0, "max_lateness": 0.0, "total_lateness": 0.0,
+                                             "duration": 0.0})
+
+    def dispatch(self, job: Job, scheduled: float = None) -> bool:
+        """
+        run the job in the pool unless its previous run is in progress, scheduled is when it was due.
+        Return whether it was dispatched
+        """
+        now = time.time()
+        with self._lock:
+            stats = self._job_stats(job.name)
+            if job.name in self._in_progress:
+                stats["skipped"] += 1
+                warnings.warn(RuntimeWarning(f"{job.name} skipped, its previous run is still in progress"))
+                return False
+            self._in_progress[job.name] = now
+            self.state.update(job.name, last_run=now)
+            stats["runs"] += 1
+            if scheduled is not None:
+                stats["lateness"] = max(now - scheduled, 0)
+                stats["max_lateness"] = max(stats["max_lateness"], stats["lateness"])
+                stats["total_lateness"] += stats["lateness"]
+        self.executor.submit(self._run, job, now)
+        return True
+
+    def _run(self, job: Job, start: float):
+        try:
+            job.run()
+        except Exception:
+            with self._lock:
+                self._job_stats(job.name)["failures"] += 1
+            traceback.print_exc()
+        finally:
+            with self._lock:
+                self._in_progress.pop(job.name, None)
+                self._timed_out.discard(job.name)
+                self._job_stats(job.name)["duration"] = time.time() - start
+
+    def _check_timeouts(self) -> (float, None):
+        """report the runs over the timeout, return the seconds until the next run in progress times out"""
+        if self.job_timeout_seconds is None:
+            return None
+        now = time.time()
+        next_timeout = None
+        with self._lock:
+            for name, start in self._in_progress.items():
+                if name in self._timed_out:
+                    continue
+                remaining = start + self.job_timeout_seconds - now
+                if remaining <= 0:
+                    self._timed_out.add(name)
+                    self._job_stats(name)["timeouts"] += 1
+                    warnings.warn(RuntimeWarning(f"{name} has been running for over {self.job_timeout_seconds}s"))
+                elif next_timeout is None or remaining < next_timeout:
+                    next_timeout = remaining
+        return next_timeout
+
+    def restore(self) -> list[Job]:
+        """
+        move the interval jobs back on their saved cadence,
+        return one job per name that missed a run since its last saved run
+        """
+        now = time.time()
+        missed = dict()
+        for job in self.queue.jobs():
+            last_run = self.state.last_run(job.name)
+            next_due = self.state.next_due(job.name)
+            if job.offset_seconds is None and next_due is not None:
+                self.queue.move(job, next_due)
+                if next_due <= now:
+                    missed.setdefault(job.name, job)
+            elif last_run is not None and job.next_run - job.interval_seconds > last_run:
+                missed.setdefault(job.name, job)
+        return list(missed.values())
+
+    def save_state(self):
+        """save the last runs and the earliest next run of every job name"""
+        next_due = dict()
+        for job in self.queue.jobs():
+            next_due[job.name] = min(next_due.get(job.name, job.next_run), job.next_run)
+        with self._lock:
+            for name, due in next_due.items():
+                self.state.update(name, next_due=due)
+            self.state.save()
 
     def start(self):
         if self.call_when_started:
-            for job in schedule_lib.get_jobs():
-                job.run()
+            for job in self.queue.jobs():
+                self.dispatch(job)
+        else:
+            for job in self.restore():
+                self.dispatch(job)
+        self.save_state()
         while self.running:
-            schedule_lib.run_pending()
-            time.sleep(self.interval_seconds)
+            next_timeout = self._check_timeouts()
+            timeout = self.interval_seconds if next_timeout is None else min(self.interval_seconds, next_timeout)
+            due = self.queue.pop_due(timeout)
+            dispatched = set()
+            for job in due:
+                # the runs of a name due together, like after a suspend of the host, are coalesced into one
+                if job.name not in dispatched and self.dispatch(job, job.due):
+                    dispatched.add(job.name)
+                self.queue.reschedule(job)
+            if due:
+                self.save_state()
 
     def stop(self):
         self.running = False
+        self.queue.wake()
+        self.executor.shutdown(wait=False)
 
     def is_running(self):
         return self.running
 
+    def stats(self) -> dict[str, dict]:
+        """runs, skipped runs, failures, timeouts, lateness and duration in seconds of the latest run per job"""
+        now = time.time()
+        with self._lock:
+            return {name: {**{key: round(value, 3) if isinstance(value, float) else value
+                              for key, value in stats.items() if key != "total_lateness"},
+                           "mean_lateness": round(stats["total_lateness"] / stats["runs"], 3) if stats["runs"] else 0,
+                           "running_for": round(now - self._in_progress[name], 3)
+                           if name in self._in_progress else None}
+                    for name, stats in self._stats.items()}
+
 
 if __name__ == '__main__':
     schedule(20, start_on_full_hour=True)(time.time)
-    print(*[a + b for a, b in zip(*[iter(str(schedule_lib.get_jobs()).strip("[]").split(", "))] * 2)], sep="\n")
+    print(*get_jobs(), sep="\n")
     # Scheduler(1).start()
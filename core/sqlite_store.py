@@ -0,0 +1,140 @@
+import json
+import os
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+
+data_file_extension = ".json"
+
+
+def point_timestamp(data_point: dict) -> float:
+    """the date of the data point, in UTC like the Date header it comes from, as a timestamp"""
+    return datetime.fromisoformat(data_point['date']).replace(tzinfo=timezone.utc).timestamp()
+
+
+class SQLiteStore:
+    """
+    data points in an sqlite database in WAL mode, one row per point with its group, month and timestamp,
+    indexed by (group, ts) so a month is read from the rows around it only.
+    The data file names `<group>.<YYYYMM>.json` map to a group and a month,
+    so the store can stand in for the data folder behind models.
+    The last rowid and the count of every file are kept in the files table, updated with its points,
+    so listing the files and their versions does not touch the points.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = Lock()
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute('CREATE TABLE IF NOT EXISTS traffic ("group" TEXT NOT NULL, month TEXT NOT NULL, '
+                                     'ts REAL NOT NULL, data TEXT NOT NULL)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS traffic_group_ts ON traffic ("group", ts)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS files ("group" TEXT NOT NULL, month TEXT NOT NULL, '
+                                     'last INTEGER NOT NULL, count INTEGER NOT NULL, PRIMARY KEY ("group", month))')
+            if self._connection.execute('SELECT 1 FROM files LIMIT 1').fetchone() is None:
+                # a database from before the files table
+                self._connection.execute('INSERT INTO files SELECT "group", month, MAX(rowid), COUNT(*) FROM traffic '
+                                         'GROUP BY "group", month')
+
+    @staticmethod
+    def file_key(file_name: str) -> tuple[str, str]:
+        """(group, month) of a data file name"""
+        group, month = os.path.splitext(os.path.basename(file_name))[0].rsplit('.', 1)
+        return group, month
+
+    def _insert(self, group: str, month: str, points: list[tuple[float, str]]):
+        """insert the points and count them in the files table"""
+        if not points:
+            return
+        self._connection.executemany('INSERT INTO traffic ("group", month, ts, data) VALUES (?, ?, ?, ?)',
+                                     [(group, month, ts, data) for ts, data in points])
+        self._connection.execute('INSERT INTO files VALUES (?, ?, last_insert_rowid(), ?) '
+                                 'ON CONFLICT ("group", month) DO UPDATE SET last = excluded.last, '
+                                 'count = count + excluded.count', (group, month, len(points)))
+
+    @staticmethod
+    def month_range(month: str) -> tuple[float, float]:
+        """
+        the timestamps around a month in local time, a day wider on both sides,
+        as the points are dated in UTC while the file month is local
+        """
+        start = datetime.strptime(month, "%Y%m").replace(tzinfo=timezone.utc)
+        end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+        return (start - timedelta(days=1)).timestamp(), (end + timedelta(days=1)).timestamp()
+
+    def read(self, file_name: str) -> list[dict]:
+        """the points of the data file in the order they were written, through the (group, ts) index"""
+        group, month = self.file_key(file_name)
+        try:
+            start, end = self.month_range(month)
+        except ValueError:
+            start, end = float('-inf'), float('inf')
+        with self._lock:
+            rows = self._connection.execute('SELECT data FROM traffic WHERE "group" = ? AND ts >= ? AND ts < ? '
+                                            'AND month = ? ORDER BY rowid',
+                                            (group, start, end, month)).fetchall()
+        return [json.loads(data) for data, in rows]
+
+    def write(self, file_name: str, data: list[dict]):
+        """replace the points of the data file"""
+        group, month = self.file_key(file_name)
+        points = [(point_timestamp(point), json.dumps(point)) for point in data]
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                self._connection.execute('DELETE FROM traffic WHERE "group" = ? AND month = ?', (group, month))
+                self._connection.execute('DELETE FROM files WHERE "group" = ? AND month = ?', (group, month))
+                self._insert(group, month, points)
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def append_lines(self, file_name: str, lines: list[str]):
+        """append the points serialized as json lines to the data file in one transaction"""
+        group, month = self.file_key(file_name)
+        points = [(point_timestamp(json.loads(line)), line.strip()) for line in lines if line.strip()]
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                self._insert(group, month, points)
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def has(self, file_name: str) -> bool:
+        group, month = self.file_key(file_name)
+        with self._lock:
+            return self._connection.execute('SELECT 1 FROM files WHERE "group" = ? AND month = ?',
+                                            (group, month)).fetchone() is not None
+
+    def version(self, file_name: str) -> (tuple[int, int], None):
+        """(last rowid, count) of the points of the data file, changes whenever they do, None if there are none"""
+        group, month = self.file_key(file_name)
+        with self._lock:
+            row = self._connection.execute('SELECT last, count FROM files WHERE "group" = ? AND month = ?',
+                                           (group, month)).fetchone()
+        return tuple(row) if row is not None else None
+
+    def list_file_names(self) -> list[str]:
+        """the data file names in the store, the one written to last at the end"""
+        with self._lock:
+            rows = self._connection.execute('SELECT "group", month FROM files ORDER BY last').fetchall()
+        return [f"{group}.{month}{data_file_extension}" for group, month in rows]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+if __name__ == '__main__':
+    # one-shot import of the data files into the default database
+    import models
+
+    _store = SQLiteStore(os.path.join(models.data_folder_path, "traffic.sqlite3"))
+    print(f"imported {models.import_data_files(_store)} into {_store.path}")
+    _store.close()
@@ -1,13 +1,17 @@
 import csv
+import functools
 import os
 import re
 import warnings
+from collections import OrderedDict
 from dataclasses import asdict
+from threading import Lock
 
-from flask import jsonify
+from flask import jsonify, Response
 
 import plot
-from models import data_folder_path, parse_data, list_data_file_name, TrafficDataList, list_to_mb_in_float, \
+from models import load_traffic_data, list_data_file_name, data_file_name, data_file_version, TrafficDataList, \
+    list_to_mb_in_float, \
     list_to_gb_in_float, \
     GranDataList, track_group
 
@@ -23,61 +27,96 @@ def dict_merge(*dicts):
     return result
 
 
-def build_translation_dict(init_language: str, target_language,
-                           translation_table_path: str = default_translation_table_path) -> (dict, list):
+class Translator:
+    """
+    Translation from one language column of the translation table to another,
+    the `re:` rows are combined into a single alternation and the results are memoized per string.
+    """
+
+    def __init__(self, trans_table: dict[str, str], trans_re_list: list[list[re.Pattern | str]],
+                 memo_size: int = 4096):
+        self.trans_table = trans_table
+        self.trans_re_list = trans_re_list
+        # the alternation tries the rows in order like matching them one by one
+        self.trans_re = re.compile("|".join(f"(?P<_{i}>{trans_row[0].pattern})"
+                                            for i, trans_row in enumerate(trans_re_list)),
+                                   re.IGNORECASE) if trans_re_list else None
+        self.trans_re_targets = {f"_{i}": trans_row[1] for i, trans_row in enumerate(trans_re_list)}
+        self.translate = functools.lru_cache(maxsize=memo_size)(self._translate)
+        self.translate_texts = functools.lru_cache(maxsize=64)(self._translate_texts)
+
+    def _translate(self, text: str) -> str:
+        translated = self.trans_table.get(text.lower())
+        if translated is not None:
+            return translated
+        if self.trans_re is not None:
+            matched = self.trans_re.match(text)
+            if matched:
+                return self.trans_re_targets[matched.lastgroup]
+        return text
+
+    def _translate_texts(self, texts: tuple[str, ...]) -> tuple[str, ...]:
+        return tuple(self.translate(text) for text in texts)
+
+    def lookup(self, text: str) -> str:
+        """translate by the table only"""
+        return self.trans_table.get(text.lower(), text)
+
+
+def build_translators(init_language: str = "en", translation_table_path: str = default_translation_table_path
+                      ) -> list[tuple[re.Pattern, Translator]]:
+    """compile the translations from init_language to every language column of the translation table"""
     with open(translation_table_path, 'r', encoding='utf-8') as _f:
         trans_table_reader = csv.reader(_f)
         titles = next(trans_table_reader)
-        titles_regex = [re.compile(_t, re.IGNORECASE) for _t in titles]
-        init_language_index = target_language_index = -1
-        for title_regex in titles_regex:
-            if title_regex.match(init_language):
-                init_language_index = titles.index(title_regex.pattern)
-            if title_regex.match(target_language):
-                target_language_index = titles.index(title_regex.pattern)
-        if init_language_index == -1:
-            warnings.warn(RuntimeWarning(f"init_language '{init_language}' not found in translation_table"))
-            init_language_index = 0
-        if target_language_index == -1:
-            warnings.warn(RuntimeWarning(f"target_language '{target_language}' not found in translation_table"))
-            target_language_index = 0
+        rows = list(trans_table_reader)
+    titles_regex = [re.compile(_t, re.IGNORECASE) for _t in titles]
+    init_language_index = -1
+    for index, title_regex in enumerate(titles_regex):
+        if title_regex.match(init_language):
+            init_language_index = index
+    if init_language_index == -1:
+        warnings.warn(RuntimeWarning(f"init_language '{init_language}' not found in translation_table"))
+        init_language_index = 0
+    translators = []
+    for target_language_index, title_regex in enumerate(titles_regex):
         trans_table: dict[str, str] = {}
         trans_re_list: list[list[re.Pattern | str]] = []
-        for row in trans_table_reader:
+        for row in rows:
             if row[init_language_index].startswith("re:"):
                 trans_re_list.append([re.compile(row[init_language_index][3:], re.IGNORECASE),
                                       row[target_language_index]])
             else:
                 trans_table[row[init_language_index].lower()] = row[target_language_index]
-    return trans_table, trans_re_list
+        translators.append((title_regex, Translator(trans_table, trans_re_list)))
+    return translators
+
 
+@functools.lru_cache(maxsize=64)
+def get_translator(language: str) -> Translator:
+    """the translator from english to the language, the last matching column of the translation table is used"""
+    translator = None
+    for title_regex, _translator in en_translators:
+        if title_regex.match(language):
+            translator = _translator
+    if translator is None:
+        warnings.warn(RuntimeWarning(f"target_language '{language}' not found in translation_table"))
+        translator = en_translators[0][1]
+    return translator
 
-def dict_translate(_dict: dict, trans_table: dict[str, str], trans_re_list: list[re.Pattern, str]):
+
+def dict_translate(_dict: dict, translator: Translator):
     new_dict = {}
     for key, value in _dict.items():
         if isinstance(key, str):
-            if key.lower() in trans_table:
-                key = trans_table[key.lower()]
-            else:
-                for trans_row in trans_re_list:
-                    if trans_row[0].match(key):
-                        key = trans_row[1]
-                        break
-
+            key = translator.translate(key)
         if isinstance(value, str):
-            if value.lower() in trans_table:
-                value = trans_table[value.lower()]
-            else:
-                for trans_row in trans_re_list:
-                    if trans_row[0].match(value):
-                        value = trans_row[1]
-                        break
-
+            value = translator.translate(value)
         new_dict[key] = value
     return new_dict
 
 
-def deep_dict_translate(_dict: dict, trans_table: dict[str, str], trans_re_list: list[re.Pattern, str],
+def deep_dict_translate(_dict: dict, translator: Translator,
                         skip_keys: (tuple[str], list[str]) = (
                                 'data', 'titleFontSize', 'titleColor', 'backgroundColor', 'borderColor',
                                 'fill', 'pointRadius', 'pointBackgroundColor', 'pointBorderColor', 'tension',
@@ -91,8 +130,8 @@ def deep_dict_translate(_dict: dict, trans_table: dict[str, str], trans_re_list:
     #     {key: [deep_dict_translate(i, trans_table, trans_re_list) for i in value] for key, value in _dict.items()
     #      if isinstance(value, list)}
     # ) if isinstance(_dict, dict) else _dict
-    if isinstance(_dict, str) and _dict.lower() in trans_table:
-        return trans_table[_dict.lower()]
+    if isinstance(_dict, str):
+        return translator.lookup(_dict)
     if not isinstance(_dict, dict):
         return _dict
     translatable = {}
@@ -102,28 +141,106 @@ def deep_dict_translate(_dict: dict, trans_table: dict[str, str], trans_re_list:
             untranslatable[key] = value
             # print(f"skip {key}: {value}")
         elif isinstance(value, dict):
-            untranslatable[key] = deep_dict_translate(value, trans_table, trans_re_list)
+            untranslatable[key] = deep_dict_translate(value, translator)
         elif isinstance(value, list):
             if value and isinstance(value[0], str) and date_label_regex.match(value[0]):
                 # print(f"skip {key}: {value}")
                 untranslatable[key] = value
             else:
-                untranslatable[key] = [deep_dict_translate(i, trans_table, trans_re_list) for i in value]
+                untranslatable[key] = [deep_dict_translate(i, translator) for i in value]
         else:
             translatable[key] = value
     return dict_merge(
-        dict_translate(translatable, trans_table, trans_re_list),
+        dict_translate(translatable, translator),
         untranslatable
     )
 
 
+class ResponseCache:
+    """LRU cache of serialized responses, keyed by (request args, data file, data file version, language)"""
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple, bytes] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: tuple) -> (bytes, None):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key: tuple, body: bytes):
+        with self._lock:
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, file_name: str = None):
+        """drop the responses of the data file, or all responses"""
+        with self._lock:
+            for key in list(self._entries):
+                if file_name is None or key[1] == data_file_name(file_name):
+                    del self._entries[key]
+
+    def info(self) -> dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries),
+                    "bytes": sum(len(body) for body in self._entries.values()), "max_entries": self.max_entries}
+
+
+dashboard_glance_cache = ResponseCache()
+
+
+def dashboard_glance_skeleton(response_dict: dict) -> list[tuple[dict | list, str | int]]:
+    """
+    the translatable text slots of a dashboard glance response, as (container, key):
+    plot titles, axis names, dataset labels, pie labels and info table names.
+    Data and date label arrays are left out, so translation cost does not grow with the data.
+    """
+    slots = []
+    for line_plot in response_dict['row']:
+        slots.extend((line_plot, key) for key in ('title', 'xAxisName', 'yAxisName'))
+        slots.extend((dataset, 'label') for dataset in line_plot['datasets'])
+    pie_plot = response_dict['percentageAvailableChart']
+    slots.append((pie_plot, 'title'))
+    slots.extend((pie_plot['labels'], index) for index in range(len(pie_plot['labels'])))
+    slots.extend((dataset, 'name') for dataset in pie_plot['datasets'])
+    slots.extend((info_row, 'name') for info_row in response_dict['infoTable'])
+    return [(container, key) for container, key in slots if isinstance(container[key], str)]
+
+
+def translate_dashboard_glance(response_dict: dict, translator: Translator) -> dict:
+    """translate the skeleton of the response in place, the translated skeleton is cached by the translator"""
+    skeleton = dashboard_glance_skeleton(response_dict)
+    translated = translator.translate_texts(tuple(container[key] for container, key in skeleton))
+    for (container, key), text in zip(skeleton, translated):
+        container[key] = text
+    return response_dict
+
+
 def dashboard_glance_data_packer(filename: str = None, language: str = "en"):
+    data_file = data_file_name(filename) if filename else list_data_file_name()[0]
+    cache_key = (filename, data_file, data_file_version(data_file), language)
+    body = dashboard_glance_cache.get(cache_key)
+    if body is None:
+        body = dashboard_glance_data_packer_uncached(filename, language).get_data()
+        dashboard_glance_cache.put(cache_key, body)
+    return Response(body, mimetype="application/json")
+
+
+def dashboard_glance_data_packer_uncached(filename: str = None, language: str = "en"):
     if filename:
-        raw_traffic_data: TrafficDataList = TrafficDataList.from_list(parse_data(filename))
+        raw_traffic_data: TrafficDataList = load_traffic_data(filename)
     else:
-        raw_traffic_data: TrafficDataList = TrafficDataList.from_list(
-            parse_data([json_file for json_file in os.listdir(data_folder_path)
-                        if json_file.endswith('.json')][0]))
+        raw_traffic_data: TrafficDataList = load_traffic_data(list_data_file_name()[0])
 
     month_traffic_data: GranDataList = raw_traffic_data.latest_month_data(
     ).get_data_by_gran(granularity_sec=60 * 60, start_date=raw_traffic_data.get_date()[-1].replace(
@@ -246,11 +363,7 @@ def dashboard_glance_data_packer(filename: str = None, language: str = "en"):
     data_panel_info_table = [{"name": _k, "value": _v} for _k, _v in track_group(month_traffic_data).items()]
     response_dict = dict(row=_plot.asdict(), percentageAvailableChart=asdict(percentage_available_chart),
                          infoTable=data_panel_info_table, filename=filename)
-    if language == 'zh':
-        trans_table, trans_re_list = en_to_zh_trans_table, en_to_zh_trans_re_list
-    else:
-        trans_table, trans_re_list = build_translation_dict("en", language)
-    response_dict = deep_dict_translate(response_dict, trans_table, trans_re_list)
+    response_dict = translate_dashboard_glance(response_dict, get_translator(language))
     _response = jsonify(response_dict)
     return _response
 
@@ -261,9 +374,8 @@ def dashboard_glance_data_list_packer():
     return _response
 
 
-en_to_zh_trans_table, en_to_zh_trans_re_list = build_translation_dict('en', 'zh')
+en_translators = build_translators('en')
 
 if __name__ == '__main__':
     # translation test
-    print(deep_dict_translate({'traffic': 20, 'lines': {'upload': 10, 'download': 10}},
-                              en_to_zh_trans_table, en_to_zh_trans_re_list))
+    print(deep_dict_translate({'traffic': 20, 'lines': {'upload': 10, 'download': 10}}, get_translator('zh')))
@@ -0,0 +1,90 @@
+import os
+import sys
+import unittest
+import warnings
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "core"))
+
+import requests  # noqa: E402
+
+import collector  # noqa: E402
+from async_collector import AsyncCollector  # noqa: E402
+
+USERINFO = "upload=1; download=2; total=100; expire=1719808630"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """a subscription answering /ok with its headers, /fail with 500 and counting the requests per path"""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests[self.path] = self.server.requests.get(self.path, 0) + 1
+        body = b"proxies" if self.path.startswith("/ok") else b""
+        self.send_response(200 if self.path.startswith("/ok") else 500)
+        self.send_header("Date", formatdate(usegmt=True))
+        if self.path.startswith("/ok"):
+            self.send_header("Subscription-Userinfo", USERINFO)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class AsyncCollectorTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        cls.server.requests = {}
+        Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        warnings.simplefilter("ignore")
+        self.server.requests.clear()
+        self.proxies, collector.proxies = collector.proxies, {}
+        self.engine = AsyncCollector(max_concurrency=4, max_per_host=2, timeout=5, retries=1, backoff_seconds=0)
+
+    def tearDown(self):
+        self.engine.close()
+        collector.proxies = self.proxies
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}{path}/{self.id()}"
+
+    def test_fetch(self):
+        data = self.engine.run(self.engine.fetch(self.url("/ok"), read_body=True))
+        self.assertEqual((data["upload"], data["download"], data["total"]), (1, 2, 100))
+        self.assertEqual(data["body"], "proxies")
+
+    def test_failover_to_the_next_url(self):
+        group = {"name": "failover", "urls-with-token": [{"url": self.url("/fail")}, {"url": self.url("/ok")}]}
+        data = self.engine.run(self.engine.collect_group_data(group))
+        self.assertEqual(data["url"], self.url("/ok"))
+        self.assertEqual(self.server.requests, {self.url("/fail")[len(self.base_url):]: 1,
+                                                self.url("/ok")[len(self.base_url):]: 1})
+
+    def test_retries_then_fails(self):
+        group = {"name": "dead", "urls-with-token": [{"url": self.url("/fail")}]}
+        with self.assertRaises(requests.exceptions.RequestException):
+            self.engine.run(self.engine.collect_group_data(group))
+        # one round and retries more
+        self.assertEqual(self.server.requests, {self.url("/fail")[len(self.base_url):]: 2})
+
+    def test_groups_concurrently(self):
+        groups = [{"name": f"group{i}", "urls-with-token": [{"url": self.url(f"/ok{i}")}]} for i in range(8)]
+        results = self.engine.run(self.engine.collect_groups_data(groups))
+        self.assertEqual([result["url"] for result in results], [self.url(f"/ok{i}") for i in range(8)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import random
+import sys
+import unittest
+import warnings
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "core"))
+os.chdir(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "core"))
+
+from models import TrafficDataList, GranDataPoint  # noqa: E402
+
+
+def reference_get_data_by_gran(data_list: TrafficDataList, start_date: datetime = None, end_date: datetime = None,
+                               granularity_sec: int = None) -> list:
+    """the resampling loop before the columnar rewrite, the points it returns in order"""
+    if start_date is None:
+        start_date = data_list[0].date
+    if end_date is None:
+        end_date = data_list[-1].date
+    result_data = list()
+    current_timestamp = start_date.timestamp()
+    end_timestamp = end_date.timestamp()
+    pre_point = None
+    for index, date_in_ts in enumerate(data_list._date_in_ts):
+        if date_in_ts < current_timestamp:
+            if index + 1 >= len(data_list) or data_list._date_in_ts[index + 1] >= current_timestamp:
+                pre_point = data_list._point(index)
+            continue
+        point = data_list._point(index)
+        while current_timestamp < date_in_ts and current_timestamp < end_timestamp:
+            result_data.append(GranDataPoint(pre_point, point, current_timestamp)
+                               if pre_point is not None else point)
+            current_timestamp += granularity_sec
+        if current_timestamp == date_in_ts:
+            result_data.append(point)
+            current_timestamp += granularity_sec
+        pre_point = point
+        if current_timestamp >= end_timestamp:
+            break
+    return result_data
+
+
+def make_points(dates: list[datetime], rng: random.Random = None) -> list[dict]:
+    upload = download = 0
+    points = []
+    for date in dates:
+        if rng is not None:
+            upload += rng.randint(0, 1000)
+            download += rng.randint(0, 10000)
+        points.append({"url": "https://example.com/sub", "date": date.strftime("%Y-%m-%d %H:%M:%S"),
+                       "upload": upload, "download": download, "total": 10 ** 9, "expire": 1719808630})
+    return points
+
+
+class GetDataByGranTest(unittest.TestCase):
+    def setUp(self):
+        warnings.simplefilter("ignore")
+
+    def assertSameAsReference(self, data_list: TrafficDataList, **kwargs):
+        expected = reference_get_data_by_gran(data_list, **kwargs)
+        result = data_list.get_data_by_gran(**kwargs)
+        self.assertEqual([point.date_in_ts for point in result], [point.date_in_ts for point in expected])
+        for attr in ("upload", "download", "total"):
+            for got, want in zip([getattr(point, attr) for point in result],
+                                 [getattr(point, attr) for point in expected]):
+                self.assertAlmostEqual(got, want, places=6)
+
+    def test_end_date_is_exclusive_for_grid_hits(self):
+        start = datetime(2024, 3, 1)
+        data_list = TrafficDataList.from_list(make_points([start + timedelta(minutes=m) for m in (0, 10, 20, 30)]))
+        result = data_list.get_data_by_gran(granularity_sec=600, end_date=start + timedelta(minutes=15))
+        self.assertEqual([point.date for point in result], [start, start + timedelta(minutes=10)])
+        # the default end date is the last point, which is left out
+        self.assertEqual(len(data_list.get_data_by_gran(granularity_sec=600)), 3)
+
+    def test_random_parity(self):
+        rng = random.Random(5)
+        for _ in range(300):
+            date = datetime(2024, 3, 1) + timedelta(seconds=rng.choice([0, 60, 3600, 137]))
+            dates = []
+            for _ in range(rng.randint(1, 40)):
+                dates.append(date)
+                date += timedelta(seconds=rng.choice([0, 60, 600, 3600, 1234]))
+            data_list = TrafficDataList.from_list(make_points(dates, rng), add_original_point=rng.random() < .5)
+            kwargs = {"granularity_sec": rng.choice([60, 600, 3600, 77.7])}
+            if rng.random() < .5:
+                kwargs["start_date"] = data_list[0].date + timedelta(seconds=rng.randint(-4000, 4000))
+            if rng.random() < .5:
+                kwargs["end_date"] = data_list[-1].date + timedelta(seconds=rng.randint(-4000, 4000))
+            with self.subTest(dates=dates, **kwargs):
+                self.assertSameAsReference(data_list, **kwargs)
+
+
+if __name__ == '__main__':
+    unittest.main()